@@ -1,34 +1,28 @@
-from torchvision import transforms
+import argparse
+import os
+import sys
+
 import torchvision
 import torch
 import matplotlib.pyplot as plt
 import numpy as np
 
 import torch.nn as nn
-import torch.nn.functional as F
 import torch.optim as optim
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from batch_transforms import BatchNormalize, RawImages, normalized
+from checkpoint import AsyncCheckpointer, Checkpoint, latest, resume
+from compile_mode import CompileTimer, compile_model
+import fast_data
+import large_batch
+from memory_format import fuse_for_cpu_inference, to_channels_last
+from models import Net
+import placement
+from trainer import RunningLoss, Throughput, Trainer
+from tune_loader import load_profile
 
 
-class Net(nn.Module):
-    def __init__(self):
-        super(Net, self).__init__()
-        self.conv1 = nn.Conv2d(3, 6, 5)
-        self.pool = nn.MaxPool2d(2, 2)
-        self.conv2 = nn.Conv2d(6, 16, 5)
-        self.fc1 = nn.Linear(16 * 5 * 5, 120)
-        self.fc2 = nn.Linear(120, 84)
-        self.fc3 = nn.Linear(84, 10)
-
-    def forward(self, x):
-        x = self.pool(F.relu(self.conv1(x)))
-        x = self.pool(F.relu(self.conv2(x)))
-        x = x.view(-1, 16 * 5 * 5)
-        x = F.relu(self.fc1(x))
-        x = F.relu(self.fc2(x))
-        x = self.fc3(x)
-        return x
-
 def imshow(img):
     img = img / 2 + 0.5 
     npimg = img.numpy()
@@ -36,16 +30,68 @@ def imshow(img):
     plt.show()
 
 if __name__ == '__main__':
-    transform = transforms.Compose([
-        transforms.ToTensor(), 
-        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-    ])
-    
-    trainset = torchvision.datasets.CIFAR10(root='./data', train=True, download=True, transform=transform)
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=4, shuffle=True, num_workers=2)
-    
-    testset = torchvision.datasets.CIFAR10(root='./data', train=False, download=True, transform=transform)
-    testloader = torch.utils.data.DataLoader(testset, batch_size=4, shuffle=False, num_workers=2)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', choices=['workers', 'memory'], default='workers',
+                        help='memory: keep each split as one uint8 tensor and fancy-index batches in-process')
+    parser.add_argument('--precision', choices=['fp32', 'bf16', 'fp16'], default='fp32',
+                        help='bf16: autocast the forward pass, fp32 master weights, no loss scaling')
+    parser.add_argument('--compile', action='store_true',
+                        help='train through torch.compile, caching kernels in compile_cache/')
+    parser.add_argument('--channels-last', action='store_true',
+                        help='NHWC batches and weights; evaluate through a frozen oneDNN graph with conv+relu fused')
+    parser.add_argument('--batch-size', type=int,
+                        help='effective batch size; micro-batches are accumulated to reach it and the lr is scaled')
+    parser.add_argument('--memory-mb', type=int, default=512,
+                        help='activation memory budget for one micro-batch')
+    parser.add_argument('--lr-scaling', choices=['linear', 'sqrt'], default='linear')
+    parser.add_argument('--warmup-epochs', type=float, default=0.5)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--pin', action='store_true',
+                        help='give each loader worker its own core, pin compute threads to the rest of one NUMA node')
+    parser.add_argument('--checkpoint-every', type=int, metavar='STEPS',
+                        help='checkpoint model, optimizer and loader position into checkpoints/ every STEPS steps')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the newest checkpoint, at the next unseen batch')
+    args = parser.parse_args()
+
+    # workers only index raw uint8 images; conversion + normalization run once per batch inside the model
+    mean, std = (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)
+
+    # tuned with `python tune_loader.py cifar10`; falls back to the tutorial settings
+    loader_settings = load_profile('cifar10', batch_size=4, num_workers=2)
+    if args.pin:
+        cores = placement.plan(loader_settings['num_workers'] if args.data == 'workers' else 0).apply()
+        print(cores)
+        if args.data == 'workers':
+            loader_settings['worker_init_fn'] = cores.worker_init
+    net = normalized(Net(), mean, std)
+    lr = 0.001
+    plan = None
+    if args.batch_size:
+        # the tutorial's lr was tuned for batches of 4
+        plan = large_batch.plan(net, torch.zeros(1, 3, 32, 32, dtype=torch.uint8), args.batch_size,
+                                base_lr=lr, base_batch_size=4, memory_mb=args.memory_mb, rule=args.lr_scaling)
+        loader_settings['batch_size'] = plan.micro_batch_size
+        lr = plan.lr
+        print(plan)
+
+    if args.data == 'memory':
+        batch_size = loader_settings['batch_size']
+        trainset = fast_data.InMemoryDataset(torchvision.datasets.CIFAR10(root='./data', train=True, download=True))
+        trainloader = fast_data.BatchLoader(trainset, batch_size=batch_size, shuffle=True, raw=True)
+        data_state = trainloader
+
+        testset = fast_data.InMemoryDataset(torchvision.datasets.CIFAR10(root='./data', train=False, download=True))
+        testloader = fast_data.BatchLoader(testset, batch_size=batch_size, shuffle=False, raw=True)
+    else:
+        # decoded once into shared memory; workers index views of the same segment
+        trainset = fast_data.SharedMemoryDataset(RawImages(torchvision.datasets.CIFAR10(root='./data', train=True, download=True)))
+        # shuffled from (seed, epoch), so a checkpoint can name the exact batch to resume at
+        data_state = fast_data.ResumableSampler(trainset, loader_settings['batch_size'], seed=0)
+        trainloader = torch.utils.data.DataLoader(trainset, sampler=data_state, **loader_settings)
+
+        testset = fast_data.SharedMemoryDataset(RawImages(torchvision.datasets.CIFAR10(root='./data', train=False, download=True)))
+        testloader = torch.utils.data.DataLoader(testset, shuffle=False, **loader_settings)
 
     classes = ('plane', 'car', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck')
 
@@ -55,37 +101,49 @@ if __name__ == '__main__':
     
     print(' '.join('%5s' % classes[labels[j]] for j in range(4)))
 
-    imshow(torchvision.utils.make_grid(images))
+    imshow(torchvision.utils.make_grid(BatchNormalize(mean, std)(images)))
 
-    net = Net()
+    memory_format = None
+    if args.channels_last:
+        net = to_channels_last(net)
+        memory_format = torch.channels_last
 
     criterion = nn.CrossEntropyLoss()
-    optimizer = optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
+    optimizer = optim.SGD(net.parameters(), lr=lr, momentum=0.9)
+    accumulation_steps, scheduler = 1, None
+    if plan is not None:
+        accumulation_steps = plan.accumulation_steps
+        scheduler = large_batch.warmup(optimizer, round(args.warmup_epochs * len(trainset) / plan.batch_size),
+                                       start_factor=0.001 / lr)
+
+    # forward + backward + optimize, printing the mean loss every 2000 mini-batches
+    callbacks = [RunningLoss(2000), Throughput()]
+    train_net = net
+    if args.compile:
+        train_net = compile_model(net)
+        callbacks.append(CompileTimer())
+    checkpointer = None
+    if args.checkpoint_every:
+        checkpointer = AsyncCheckpointer('checkpoints')
+        callbacks.append(Checkpoint(checkpointer, args.checkpoint_every, model=net, data=data_state))
+    trainer = Trainer(train_net, criterion, optimizer, callbacks=callbacks, precision=args.precision,
+                      memory_format=memory_format, accumulation_steps=accumulation_steps, scheduler=scheduler)
+    if args.resume and latest('checkpoints'):
+        resume(latest('checkpoints'), trainer, model=net, data=data_state)
+        print(f'resuming at epoch {trainer.epoch + 1}, batch {trainer.start_batch}')
+    trainer.fit(trainloader, epochs=args.epochs - trainer.epoch)  # loop over the dataset multiple times
+    if checkpointer is not None:
+        checkpointer.close()
 
-    for epoch in range(2):  # loop over the dataset multiple times
-
-        running_loss = 0.0
-        for i, data in enumerate(trainloader, 0):
-            # get the inputs
-            inputs, labels = data
-
-            # zero the parameter gradients
-            optimizer.zero_grad()
-
-            # forward + backward + optimize
-            outputs = net(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
+    print('Finished Training')
 
-            # print statistics
-            running_loss += loss.item()
-            if i % 2000 == 1999:    # print every 2000 mini-batches
-                print('[%d, %5d] loss: %.3f' %
-                    (epoch + 1, i + 1, running_loss / 2000))
-                running_loss = 0.0
+    PATH = './cifar_net.pth'
+    torch.save(net.state_dict(), PATH)
 
-    print('Finished Training')
+    # loss, confusion matrix and per-class precision/recall, accumulated on the device
+    if args.channels_last:
+        trainer = Trainer(fuse_for_cpu_inference(net, images), criterion, memory_format=memory_format)
+    print(trainer.evaluate(testloader)['metrics'].report(classes))
 
 
 
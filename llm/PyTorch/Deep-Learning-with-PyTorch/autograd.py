@@ -1,6 +1,12 @@
+import os
+import sys
+
 import torch
 import torch.optim as optim
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from trainer import PrintEpochLoss, Trainer
+
 t_c = [0.5,  14.0, 15.0, 28.0, 11.0,  8.0,  3.0, -4.0,  6.0, 13.0, 21.0]
 t_u = [35.7, 55.9, 58.2, 81.9, 56.3, 48.9, 33.9, 21.8, 48.4, 60.4, 68.4]
 t_c = torch.tensor(t_c)
@@ -24,19 +30,9 @@ print('params.grad:', params.grad)
 # print('params.grad:', params.grad)
 
 def training_loop(n_epochs, optimizer, params, t_u, t_c):
-    for epoch in range(1, n_epochs + 1):
-        t_p = model(t_u, *params)
-
-        loss = loss_fn(t_p, t_c)
-
-        optimizer.zero_grad()
-
-        loss.backward()
-
-        optimizer.step()
-        
-        if epoch % 500 == 0:
-            print(f'Epoch {epoch}, Loss {loss.item()}')
+    # the whole dataset is one batch, so every Trainer epoch is one optimizer step
+    trainer = Trainer(lambda t_u: model(t_u, *params), loss_fn, optimizer, callbacks=[PrintEpochLoss(500)])
+    trainer.fit([(t_u, t_c)], epochs=n_epochs)
 
     return params
 
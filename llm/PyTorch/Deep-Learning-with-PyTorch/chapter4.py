@@ -1,6 +1,12 @@
+import os
+import sys
+
 import torch
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from trainer import Callback, Trainer
+
 
 t_c = [0.5,  14.0, 15.0, 28.0, 11.0,  8.0,  3.0, -4.0,  6.0, 13.0, 21.0]
 t_u = [35.7, 55.9, 58.2, 81.9, 56.3, 48.9, 33.9, 21.8, 48.4, 60.4, 68.4]
@@ -60,21 +66,40 @@ def grad_fn(t_u, t_c, t_p, w, b):
     dloss_b = dloss_fn(t_p, t_c) * dmodel_db(t_u, w, b)
     return torch.stack([dloss_w.mean(), dloss_b.mean()])
 
-def training_loop(n_epochs, learning_rate, params, t_u, t_c, print_params = True, verbose = 1):
-    for epoch in range(1, n_epochs + 1):
-        w, b = params
+class GradientDescent(Trainer):
+    # the Trainer loop with the hand-derived gradient in place of backward() + optimizer
+    def __init__(self, params, learning_rate, callbacks=()):
+        super().__init__(model, loss_fn, callbacks=callbacks)
+        self.params = params
+        self.learning_rate = learning_rate
+        self.grad = None
+
+    def train_step(self, t_u, t_c):
+        w, b = self.params
         t_p = model(t_u, w, b)
         loss = loss_fn(t_p, t_c)
-        grad = grad_fn(t_u, t_c, t_p, w, b)
+        self.grad = grad_fn(t_u, t_c, t_p, w, b)
 
-        params = params - learning_rate * grad
+        self.params = self.params - self.learning_rate * self.grad
+        return loss
 
-        if epoch % verbose == 0:
-            print('Epoch %d, Loss %f' %(epoch, float(loss)))
-            if print_params:
-                print('Params:', params)
-                print('Grad:', grad)
-    return params
+class PrintProgress(Callback):
+    def __init__(self, verbose, print_params):
+        self.verbose = verbose
+        self.print_params = print_params
+
+    def on_epoch_end(self, trainer):
+        epoch = trainer.epoch + 1
+        if epoch % self.verbose == 0:
+            print('Epoch %d, Loss %f' %(epoch, float(trainer.loss)))
+            if self.print_params:
+                print('Params:', trainer.params)
+                print('Grad:', trainer.grad)
+
+def training_loop(n_epochs, learning_rate, params, t_u, t_c, print_params = True, verbose = 1):
+    trainer = GradientDescent(params, learning_rate, callbacks=[PrintProgress(verbose, print_params)])
+    trainer.fit([(t_u, t_c)], epochs=n_epochs)
+    return trainer.params
 
 t_un = 0.1 * t_u
 
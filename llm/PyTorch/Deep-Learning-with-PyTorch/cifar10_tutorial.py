@@ -55,25 +55,32 @@ We will do the following steps in order:
 
 Using ``torchvision``, it’s extremely easy to load CIFAR10.
 """
+import os
+import sys
+
 import torch
 import torchvision
-import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from batch_transforms import BatchNormalize, RawImages, normalized
 
 ########################################################################
 # The output of torchvision datasets are PILImage images of range [0, 1].
-# We transform them to Tensors of normalized range [-1, 1].
+# We want Tensors of normalized range [-1, 1]. Instead of running
+# ``ToTensor()`` + ``Normalize()`` on every image inside the workers, the
+# loaders hand out raw uint8 batches and ``BatchNormalize`` converts and
+# normalizes the whole ``[N, 3, 32, 32]`` batch in one op.
 
-transform = transforms.Compose(
-    [transforms.ToTensor(),
-     transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+mean, std = (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)
+normalize = BatchNormalize(mean, std)
 
-trainset = torchvision.datasets.CIFAR10(root='./data', train=True,
-                                        download=True, transform=transform)
+trainset = RawImages(torchvision.datasets.CIFAR10(root='./data', train=True,
+                                                  download=True))
 trainloader = torch.utils.data.DataLoader(trainset, batch_size=4,
                                           shuffle=True, num_workers=2)
 
-testset = torchvision.datasets.CIFAR10(root='./data', train=False,
-                                       download=True, transform=transform)
+testset = RawImages(torchvision.datasets.CIFAR10(root='./data', train=False,
+                                                 download=True))
 testloader = torch.utils.data.DataLoader(testset, batch_size=4,
                                          shuffle=False, num_workers=2)
 
@@ -98,10 +105,10 @@ def imshow(img):
 
 # get some random training images
 dataiter = iter(trainloader)
-images, labels = dataiter.next()
+images, labels = next(dataiter)
 
 # show images
-imshow(torchvision.utils.make_grid(images))
+imshow(torchvision.utils.make_grid(normalize(images)))
 # print labels
 print(' '.join('%5s' % classes[labels[j]] for j in range(4)))
 
@@ -136,7 +143,11 @@ class Net(nn.Module):
         return x
 
 
-net = Net()
+########################################################################
+# The normalization stage becomes the first step of the forward pass, so the
+# network is fed the raw uint8 batches straight from the loader.
+
+net = normalized(Net(), mean, std)
 
 ########################################################################
 # 3. Define a Loss function and optimizer
@@ -154,30 +165,16 @@ optimizer = optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
 #
 # This is when things start to get interesting.
 # We simply have to loop over our data iterator, and feed the inputs to the
-# network and optimize.
-
-for epoch in range(2):  # loop over the dataset multiple times
+# network and optimize. That loop (zero the parameter gradients, forward +
+# backward + optimize) is the same in every script, so it lives in
+# ``trainer.Trainer``; callbacks add the printing. ``RunningLoss`` prints the
+# mean loss every 2000 mini-batches and ``Throughput`` how fast each epoch ran
+# and how much of it was spent waiting for data.
 
-    running_loss = 0.0
-    for i, data in enumerate(trainloader, 0):
-        # get the inputs
-        inputs, labels = data
+from trainer import RunningLoss, Throughput, Trainer
 
-        # zero the parameter gradients
-        optimizer.zero_grad()
-
-        # forward + backward + optimize
-        outputs = net(inputs)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-
-        # print statistics
-        running_loss += loss.item()
-        if i % 2000 == 1999:    # print every 2000 mini-batches
-            print('[%d, %5d] loss: %.3f' %
-                  (epoch + 1, i + 1, running_loss / 2000))
-            running_loss = 0.0
+trainer = Trainer(net, criterion, optimizer, callbacks=[RunningLoss(2000), Throughput()])
+trainer.fit(trainloader, epochs=2)  # loop over the dataset multiple times
 
 print('Finished Training')
 
@@ -195,10 +192,10 @@ print('Finished Training')
 # Okay, first step. Let us display an image from the test set to get familiar.
 
 dataiter = iter(testloader)
-images, labels = dataiter.next()
+images, labels = next(dataiter)
 
 # print images
-imshow(torchvision.utils.make_grid(images))
+imshow(torchvision.utils.make_grid(normalize(images)))
 print('GroundTruth: ', ' '.join('%5s' % classes[labels[j]] for j in range(4)))
 
 ########################################################################
@@ -221,18 +218,10 @@ print('Predicted: ', ' '.join('%5s' % classes[predicted[j]]
 #
 # Let us look at how the network performs on the whole dataset.
 
-correct = 0
-total = 0
-with torch.no_grad():
-    for data in testloader:
-        images, labels = data
-        outputs = net(images)
-        _, predicted = torch.max(outputs.data, 1)
-        total += labels.size(0)
-        correct += (predicted == labels).sum().item()
+results = trainer.evaluate(testloader)
 
 print('Accuracy of the network on the 10000 test images: %d %%' % (
-    100 * correct / total))
+    100 * results['accuracy']))
 
 ########################################################################
 # That looks waaay better than chance, which is 10% accuracy (randomly picking
@@ -242,23 +231,16 @@ print('Accuracy of the network on the 10000 test images: %d %%' % (
 # Hmmm, what are the classes that performed well, and the classes that did
 # not perform well:
 
-class_correct = list(0. for i in range(10))
-class_total = list(0. for i in range(10))
-with torch.no_grad():
-    for data in testloader:
-        images, labels = data
-        outputs = net(images)
-        _, predicted = torch.max(outputs, 1)
-        c = (predicted == labels).squeeze()
-        for i in range(4):
-            label = labels[i]
-            class_correct[label] += c[i].item()
-            class_total[label] += 1
-
+# ``trainer.evaluate`` already answered that: it accumulated a confusion
+# matrix on the device with one ``bincount`` per batch, so the per-class
+# accuracy (the recall of each class) needs no extra pass and no
+# per-sample ``.item()`` calls.
 
 for i in range(10):
     print('Accuracy of %5s : %2d %%' % (
-        classes[i], 100 * class_correct[i] / class_total[i]))
+        classes[i], 100 * results['recall'][i]))
+
+print(results['metrics'].report(classes))
 
 ########################################################################
 # Okay, so what next?
@@ -1,4 +1,8 @@
 # imports
+import argparse
+import os
+import sys
+
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -11,6 +15,15 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torch.utils.tensorboard import SummaryWriter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from batch_transforms import BatchNormalize, normalized
+from compile_mode import CompileTimer, compile_model
+import fast_data
+from memory_format import to_channels_last
+from models import Net
+from trainer import Callback, RunningLoss, Trainer
+from tune_loader import load_profile
+
 
 # helper function to show an image
 # (used in the `plot_classes_preds` function below)
@@ -26,25 +39,6 @@ def matplotlib_imshow(img, one_channel=False):
     plt.show()
     
 
-class Net(nn.Module):
-    def __init__(self):
-        super(Net, self).__init__()
-        self.conv1 = nn.Conv2d(1, 6, 5)
-        self.pool = nn.MaxPool2d(2, 2)
-        self.conv2 = nn.Conv2d(6, 16, 5)
-        self.fc1 = nn.Linear(16 * 4 * 4, 120)
-        self.fc2 = nn.Linear(120, 84)
-        self.fc3 = nn.Linear(84, 10)
-
-    def forward(self, x):
-        x = self.pool(F.relu(self.conv1(x)))
-        x = self.pool(F.relu(self.conv2(x)))
-        x = x.view(-1, 16 * 4 * 4)
-        x = F.relu(self.fc1(x))
-        x = F.relu(self.fc2(x))
-        x = self.fc3(x)
-        return x
-
 # helper functions
 
 def images_to_probs(net, images):
@@ -80,6 +74,32 @@ def plot_classes_preds(net, images, labels):
                     color=("green" if preds[idx]==labels[idx].item() else "red"))
     return fig
 
+class TensorBoardLogger(Callback):
+    '''
+    Every `every` mini-batches, logs the running loss and a Matplotlib Figure
+    showing the model's predictions on the current mini-batch
+    '''
+    def __init__(self, writer, net, every=1000):
+        self.writer = writer
+        self.net = net
+        self.every = every
+        self.running_loss = 0.0
+
+    def on_step_end(self, trainer):
+        self.running_loss = trainer.loss + self.running_loss
+        if trainer.batch_index % self.every == self.every - 1:
+            # ...log the running loss
+            self.writer.add_scalar('training loss',
+                            self.running_loss.item() / self.every,
+                            trainer.global_step)
+            # ...log a Matplotlib Figure showing the model's predictions on a
+            # random mini-batch
+            inputs, labels = trainer.batch
+            self.writer.add_figure('predictions vs. actuals',
+                            plot_classes_preds(self.net, inputs, labels),
+                            global_step=trainer.global_step)
+            self.running_loss = 0.0
+
 # helper function
 def select_n_random(data, labels, n=100):
     '''
@@ -92,6 +112,15 @@ def select_n_random(data, labels, n=100):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', choices=['workers', 'memory'], default='workers',
+                        help='memory: keep each split as one uint8 tensor and fancy-index batches in-process')
+    parser.add_argument('--compile', action='store_true',
+                        help='train through torch.compile, caching kernels in compile_cache/')
+    parser.add_argument('--channels-last', action='store_true',
+                        help='NHWC batches and weights, the layout oneDNN convolutions run in natively')
+    args = parser.parse_args()
+
     # transforms
     transform = transforms.Compose(
         [transforms.ToTensor(),
@@ -107,19 +136,31 @@ if __name__ == '__main__':
         train=False,
         transform=transform)
 
-    # dataloaders
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=4,
-                                            shuffle=True, num_workers=2)
-
-
-    testloader = torch.utils.data.DataLoader(testset, batch_size=4,
-                                            shuffle=False, num_workers=2)
+    # dataloaders, tuned with `python tune_loader.py tensorboard` if a profile exists
+    loader_settings = load_profile('tensorboard', batch_size=4, num_workers=2)
+    if args.data == 'memory':
+        # raw uint8 batches; the network normalizes them as its first step
+        trainloader = fast_data.BatchLoader(fast_data.InMemoryDataset(trainset), batch_size=loader_settings['batch_size'],
+                                            shuffle=True, raw=True)
+        testloader = fast_data.BatchLoader(fast_data.InMemoryDataset(testset), batch_size=loader_settings['batch_size'],
+                                           shuffle=False, raw=True)
+    else:
+        trainloader = torch.utils.data.DataLoader(trainset, shuffle=True,
+                                                **loader_settings)
+        testloader = torch.utils.data.DataLoader(testset, shuffle=False,
+                                                **loader_settings)
 
     # constant for classes
     classes = ('T-shirt/top', 'Trouser', 'Pullover', 'Dress', 'Coat',
             'Sandal', 'Shirt', 'Sneaker', 'Bag', 'Ankle Boot')
 
-    net = Net()
+    net = Net(1, 28)
+    if args.data == 'memory':
+        net = normalized(net, (0.5,), (0.5,))
+    memory_format = None
+    if args.channels_last:
+        net = to_channels_last(net)
+        memory_format = torch.channels_last
 
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
@@ -131,7 +172,7 @@ if __name__ == '__main__':
     images, labels = next(dataiter)
     print(labels)
     # create grid of images
-    img_grid = torchvision.utils.make_grid(images)
+    img_grid = torchvision.utils.make_grid(BatchNormalize((0.5,), (0.5,))(images))
 
     # show images
     matplotlib_imshow(img_grid, one_channel=True)
@@ -155,36 +196,13 @@ if __name__ == '__main__':
 
 
 
-    running_loss = 0.0
-    for epoch in range(1):  # loop over the dataset multiple times
-
-        for i, data in enumerate(trainloader, 0):
-
-            # get the inputs; data is a list of [inputs, labels]
-            inputs, labels = data
-
-            # zero the parameter gradients
-            optimizer.zero_grad()
-
-            # forward + backward + optimize
-            outputs = net(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-
-            running_loss += loss.item()
-            if i % 1000 == 999:    # every 1000 mini-batches...
-                print('[%d, %5d] loss: %.3f' %
-                    (epoch + 1, i + 1, running_loss / 2000))
-                # ...log the running loss
-                writer.add_scalar('training loss',
-                                running_loss / 1000,
-                                epoch * len(trainloader) + i)
+    # the eager `net` keeps serving add_graph and the prediction figures
+    callbacks = [RunningLoss(1000), TensorBoardLogger(writer, net, 1000)]
+    train_net = net
+    if args.compile:
+        train_net = compile_model(net)
+        callbacks.append(CompileTimer())
+    trainer = Trainer(train_net, criterion, optimizer, callbacks=callbacks, memory_format=memory_format)
+    trainer.fit(trainloader, epochs=1)  # loop over the dataset multiple times
 
-                # ...log a Matplotlib Figure showing the model's predictions on a
-                # random mini-batch
-                writer.add_figure('predictions vs. actuals',
-                                plot_classes_preds(net, inputs, labels),
-                                global_step=epoch * len(trainloader) + i)
-                running_loss = 0.0
     print('Finished Training')
\ No newline at end of file
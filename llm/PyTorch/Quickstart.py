@@ -1,22 +1,68 @@
 # https://pytorch.org/tutorials/beginner/basics/quickstart_tutorial.html
 
+import argparse
+
 import torch
 from torch import nn
 from torch.utils.data import DataLoader
 from torchvision import datasets
 from torchvision.transforms import ToTensor
 
-# Download training data from open datasets.
-training_data = datasets.FashionMNIST(root="data", train=True, download=True, transform=ToTensor(),)
-
-# Download test data from open datasets.
-test_data = datasets.FashionMNIST(root="data", train=False, download=True, transform=ToTensor(),)
-
-batch_size = 64
-
-# Create data loaders.
-train_dataloader = DataLoader(training_data, batch_size=batch_size)
-test_dataloader = DataLoader(test_data, batch_size=batch_size)
+import fast_data
+from checkpoint import AsyncCheckpointer, Checkpoint
+from compile_mode import CompileTimer, compile_model, time_first_call
+from models import NeuralNetwork
+from prefetch import Prefetcher
+from trainer import PrintLoss, Throughput, Trainer
+from tune_loader import load_profile
+import weights
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--data", choices=["torchvision", "mmap", "memory"], default="torchvision",
+                    help="mmap: read pre-decoded uint8 batches from a memory-mapped store under data/; "
+                         "memory: hold each split as one tensor in RAM")
+parser.add_argument("--prefetch", action="store_true",
+                    help="prepare the next batch (and its device copy) on a background thread during compute")
+parser.add_argument("--precision", choices=["fp32", "bf16", "fp16"], default="fp32",
+                    help="bf16: CPU/GPU autocast with fp32 master weights, no loss scaling needed")
+parser.add_argument("--compile", action="store_true",
+                    help="run training and inference through torch.compile, caching kernels in compile_cache/")
+parser.add_argument("--checkpoint-every", type=int, metavar="STEPS",
+                    help="snapshot model and optimizer every STEPS steps into checkpoints/, written in the background")
+parser.add_argument("--weights", choices=["pth", "flat"], default="pth",
+                    help="flat: save model.safetensors and reload it by mmap without copying the weights")
+parser.add_argument("--weights-dtype", choices=["fp32", "fp16", "bf16"], default="fp32",
+                    help="storage dtype for --weights flat; reduced ones are converted back to fp32 on load")
+args = parser.parse_args()
+
+# Loader settings measured by `python tune_loader.py quickstart`, if it has been run on this machine.
+loader_settings = load_profile("quickstart", batch_size=64)
+batch_size = loader_settings["batch_size"]
+
+if args.data == "mmap":
+    # Decode once into data/fashion_mnist_*.npy, then slice whole batches from the mapping.
+    training_data = fast_data.open_store("data/fashion_mnist_train", lambda: datasets.FashionMNIST(root="data", train=True, download=True))
+    test_data = fast_data.open_store("data/fashion_mnist_test", lambda: datasets.FashionMNIST(root="data", train=False, download=True))
+
+    train_dataloader = fast_data.BatchLoader(training_data, batch_size=batch_size)
+    test_dataloader = fast_data.BatchLoader(test_data, batch_size=batch_size)
+elif args.data == "memory":
+    # Whole split as one uint8 tensor; batches are fancy-indexed, no __getitem__ or collate.
+    training_data = fast_data.InMemoryDataset(datasets.FashionMNIST(root="data", train=True, download=True))
+    test_data = fast_data.InMemoryDataset(datasets.FashionMNIST(root="data", train=False, download=True))
+
+    train_dataloader = fast_data.BatchLoader(training_data, batch_size=batch_size)
+    test_dataloader = fast_data.BatchLoader(test_data, batch_size=batch_size)
+else:
+    # Download training data from open datasets.
+    training_data = datasets.FashionMNIST(root="data", train=True, download=True, transform=ToTensor(),)
+
+    # Download test data from open datasets.
+    test_data = datasets.FashionMNIST(root="data", train=False, download=True, transform=ToTensor(),)
+
+    # Create data loaders.
+    train_dataloader = DataLoader(training_data, **loader_settings)
+    test_dataloader = DataLoader(test_data, **loader_settings)
 
 for X, y in test_dataloader:
     print(f"Shape of X [N, C, H, W]: {X.shape}")
@@ -33,23 +79,9 @@ device = (
 )
 print(f"Using {device} device")
 
-# Define model
-class NeuralNetwork(nn.Module):
-    def __init__(self):
-        super().__init__()
-        self.flatten = nn.Flatten()
-        self.linear_relu_stack = nn.Sequential(
-            nn.Linear(28*28, 512),
-            nn.ReLU(),
-            nn.Linear(512, 512),
-            nn.ReLU(),
-            nn.Linear(512, 10)
-        )
-
-    def forward(self, x):
-        x = self.flatten(x)
-        logits = self.linear_relu_stack(x)
-        return logits
+if args.prefetch:
+    train_dataloader = Prefetcher(train_dataloader, device)
+    test_dataloader = Prefetcher(test_dataloader, device)
 
 model = NeuralNetwork().to(device)
 print(model)
@@ -57,54 +89,51 @@ print(model)
 loss_fn = nn.CrossEntropyLoss()
 optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
 
-def train(dataloader, model, loss_fn, optimizer):
-    size = len(dataloader.dataset)
-    model.train()
-    for batch, (X, y) in enumerate(dataloader):
-        X, y = X.to(device), y.to(device)
-
-        # Compute prediction error
-        pred = model(X)
-        loss = loss_fn(pred, y)
-
-        # Backpropagation
-        loss.backward()
-        optimizer.step()
-        optimizer.zero_grad()
-
-        if batch % 100 == 0:
-            loss, current = loss.item(), (batch + 1) * len(X)
-            print(f"loss: {loss:>7f}  [{current:>5d}/{size:>5d}]")
-
-
-def test(dataloader, model, loss_fn):
-    size = len(dataloader.dataset)
-    num_batches = len(dataloader)
-    model.eval()
-    test_loss, correct = 0, 0
-    with torch.no_grad():
-        for X, y in dataloader:
-            X, y = X.to(device), y.to(device)
-            pred = model(X)
-            test_loss += loss_fn(pred, y).item()
-            correct += (pred.argmax(1) == y).type(torch.float).sum().item()
-    test_loss /= num_batches
-    correct /= size
-    print(f"Test Error: \n Accuracy: {(100*correct):>0.1f}%, Avg loss: {test_loss:>8f} \n")
+callbacks = [PrintLoss(100), Throughput()]
+net = model
+if args.compile:
+    # `net` shares its parameters with `model`, which stays the one that gets saved
+    net = compile_model(model)
+    callbacks.append(CompileTimer())
+checkpointer = None
+if args.checkpoint_every:
+    checkpointer = AsyncCheckpointer("checkpoints", keep=3)
+    callbacks.append(Checkpoint(checkpointer, args.checkpoint_every, model=model))
 
+trainer = Trainer(net, loss_fn, optimizer, device, callbacks=callbacks, precision=args.precision)
 
 epochs = 5
 for t in range(epochs):
     print(f"Epoch {t+1}\n-------------------------------")
-    train(train_dataloader, model, loss_fn, optimizer)
-    test(test_dataloader, model, loss_fn)
+    trainer.train_epoch(train_dataloader)
+    results = trainer.evaluate(test_dataloader)
+    print(f"Test Error: \n Accuracy: {(100*results['accuracy']):>0.1f}%, Avg loss: {results['loss']:>8f} \n")
+    if args.prefetch:
+        print(f"train {train_dataloader.report()}, test {test_dataloader.report()}")
+        train_dataloader.reset_stats()
+        test_dataloader.reset_stats()
 print("Done!")
-
-torch.save(model.state_dict(), "model.pth")
-print("Saved PyTorch Model State to model.pth")
-
-model = NeuralNetwork().to(device)
-model.load_state_dict(torch.load("model.pth"))
+if checkpointer is not None:
+    checkpointer.close()
+    print(checkpointer.report())
+
+if args.weights == "flat":
+    weights.save(model.state_dict(), "model.safetensors", weights.STORAGE_DTYPES[args.weights_dtype])
+    print("Saved PyTorch Model State to model.safetensors")
+
+    if args.weights_dtype == "fp32":
+        # no init, no copy: the parameters become views of the mapped file
+        with torch.device("meta"):
+            model = NeuralNetwork()
+    else:
+        model = NeuralNetwork()
+    model = weights.load_into(model, "model.safetensors").to(device)
+else:
+    torch.save(model.state_dict(), "model.pth")
+    print("Saved PyTorch Model State to model.pth")
+
+    model = NeuralNetwork().to(device)
+    model.load_state_dict(torch.load("model.pth"))
 
 classes = ["T-shirt/top", "Trouser", "Pullover", "Dress", "Coat", "Sandal", "Shirt", "Sneaker", "Bag", "Ankle boot",]
 
@@ -112,7 +141,11 @@ model.eval()
 x, y = test_data[0][0], test_data[0][1]
 with torch.no_grad():
     x = x.to(device)
-    pred = model(x)
+    if args.compile:
+        pred, first, steady = time_first_call(compile_model(model), x)
+        print(f"inference compile (first call): {first:.2f}s, steady state: {1000 * steady:.2f} ms")
+    else:
+        pred = model(x)
     predicted, actual = classes[pred[0].argmax(0)], classes[y]
     print(f'Predicted: "{predicted}", Actual: "{actual}"')
 
@@ -1,13 +1,23 @@
-import torch
+from torch import nn
+from torch.utils.data import DataLoader
 from torchvision import datasets
-from torchvision.transforms import ToTensor, Lambda
+from torchvision.transforms import ToTensor
+
+from targets import OneHotCollate
 
 ds = datasets.FashionMNIST(
     root="data",
     train=True,
     download=True,
     transform=ToTensor(),
-    target_transform=Lambda(lambda y: torch.zeros(10, dtype=torch.float).scatter_(0, torch.tensor(y), value=1))
 )
 
-print(ds)
\ No newline at end of file
+print(ds)
+
+# One-hot encode the labels once per batch at collate time rather than per sample.
+loader = DataLoader(ds, batch_size=64, collate_fn=OneHotCollate(10))
+X, y = next(iter(loader))
+print(f"Shape of y: {y.shape} {y.dtype}")
+
+# Or keep the integer labels and let the loss do the (smoothed) encoding lazily.
+loss_fn = nn.CrossEntropyLoss(label_smoothing=0.1)
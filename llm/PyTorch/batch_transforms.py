@@ -0,0 +1,75 @@
+"""Batch-level replacements for per-sample ``ToTensor()`` + ``Normalize()``.
+
+Workers hand out raw uint8 images and the default collate stacks them into a
+uint8 ``[N, C, H, W]`` batch. ``BatchNormalize`` then converts and normalizes the
+whole batch with one multiply-add, either as a separate step or as the first
+layer of the model.
+"""
+import torch
+from torch import nn
+from torch.utils.data import Dataset
+
+
+class RawImages(Dataset):
+    """Serve a torchvision image dataset as uint8 CHW tensors without going through PIL."""
+
+    def __init__(self, dataset):
+        data = dataset.data
+        if not isinstance(data, torch.Tensor):
+            data = torch.from_numpy(data)
+        if data.dim() == 3:
+            data = data.unsqueeze(1)
+        else:
+            data = data.permute(0, 3, 1, 2)
+        self.data = data.contiguous()
+        self.targets = torch.as_tensor(dataset.targets, dtype=torch.int64)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        return self.data[index], self.targets[index]
+
+
+class BatchNormalize(nn.Module):
+    """``Normalize(mean, std)(ToTensor()(x))`` for a whole uint8 batch.
+
+    ``(x / 255 - mean) / std`` is folded into a single per-channel ``x * scale + shift``.
+
+    Floating-point input is taken to be already normalized and is returned
+    unchanged. A [0, 1] float image is *not* normalized, so convert it back to
+    uint8 before feeding it through.
+    """
+
+    def __init__(self, mean, std):
+        super().__init__()
+        mean = torch.as_tensor(mean, dtype=torch.float32)
+        std = torch.as_tensor(std, dtype=torch.float32)
+        self.register_buffer("scale", (1.0 / (255.0 * std)).view(1, -1, 1, 1))
+        self.register_buffer("shift", (-mean / std).view(1, -1, 1, 1))
+
+    def forward(self, x):
+        if x.is_floating_point():
+            return x
+        return torch.addcmul(self.shift, x.to(self.scale.dtype), self.scale)
+
+    def fold_into(self, conv):
+        """Return a copy of ``conv`` that takes ``x.float()`` of the raw batch directly.
+
+        Only exact for unpadded convs, which is what the CIFAR ``Net`` uses.
+        """
+        if conv.padding not in (0, (0, 0)) and conv.padding != "valid":
+            raise ValueError("normalization can only be folded into an unpadded conv")
+        folded = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                           stride=conv.stride, dilation=conv.dilation, groups=conv.groups)
+        folded = folded.to(conv.weight.device)
+        with torch.no_grad():
+            folded.weight.copy_(conv.weight * self.scale)
+            bias = conv.bias if conv.bias is not None else torch.zeros_like(folded.bias)
+            folded.bias.copy_(bias + (conv.weight * self.shift).sum(dim=(1, 2, 3)))
+        return folded
+
+
+def normalized(model, mean, std):
+    """Prepend a ``BatchNormalize`` stage so ``model`` can be fed raw uint8 batches."""
+    return nn.Sequential(BatchNormalize(mean, std), model)
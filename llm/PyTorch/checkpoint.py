@@ -0,0 +1,165 @@
+"""Checkpoints that cost the training loop only an in-memory copy.
+
+``AsyncCheckpointer.save`` copies every tensor of the state into a reusable
+CPU staging buffer and returns; a background thread serializes the staged
+copy to ``<name>.tmp`` and renames it into place, so a crash mid-write never
+leaves a truncated checkpoint behind. Two staging buffers alternate, so a
+save only waits if the write before last is still running. The newest
+``keep`` checkpoints are kept.
+
+Given the training loader's state (a ``BatchLoader`` or a
+``fast_data.ResumableSampler``), a checkpoint also records where in the epoch
+training stopped, and ``resume`` restarts at the next unseen batch.
+"""
+import glob
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from trainer import Callback
+
+
+def _stage(obj, buffer):
+    """Copy the tensors of a nested dict/list/tuple into ``buffer`` (same structure), reusing its storage."""
+    if isinstance(obj, torch.Tensor):
+        if isinstance(buffer, torch.Tensor) and buffer.shape == obj.shape and buffer.dtype == obj.dtype:
+            return buffer.copy_(obj.detach())
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        buffer = buffer if isinstance(buffer, dict) else {}
+        return {k: _stage(v, buffer.get(k)) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        buffer = buffer if isinstance(buffer, (list, tuple)) and len(buffer) == len(obj) else [None] * len(obj)
+        return type(obj)(_stage(v, b) for v, b in zip(obj, buffer))
+    return obj
+
+
+def checkpoints(directory, prefix="checkpoint"):
+    """Completed checkpoints in ``directory``, oldest first."""
+    pattern = re.compile(re.escape(prefix) + r"-(\d+)\.pth$")
+    found = [(int(m.group(1)), path) for path in glob.glob(os.path.join(directory, f"{prefix}-*.pth"))
+             if (m := pattern.search(os.path.basename(path)))]
+    return [path for _, path in sorted(found)]
+
+
+def latest(directory, prefix="checkpoint"):
+    found = checkpoints(directory, prefix)
+    return found[-1] if found else None
+
+
+class AsyncCheckpointer:
+    def __init__(self, directory="checkpoints", keep=3, prefix="checkpoint"):
+        self.directory = directory
+        self.keep = keep
+        self.prefix = prefix
+        self.stall_time = 0.0
+        self.write_time = 0.0
+        self.saves = 0
+        self._buffers = [None, None]
+        self._pending = [None, None]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, state, step):
+        """Stage ``state`` and queue its write as ``<prefix>-<step>.pth``; blocks only for the copy."""
+        start = time.perf_counter()
+        slot = self.saves % 2
+        if self._pending[slot] is not None:
+            self._pending[slot].result()  # this buffer is still being written; re-raises a failed write
+        self._buffers[slot] = _stage(state, self._buffers[slot])
+        path = os.path.join(self.directory, f"{self.prefix}-{step:09d}.pth")
+        self._pending[slot] = self._executor.submit(self._write, self._buffers[slot], path)
+        self.saves += 1
+        self.stall_time += time.perf_counter() - start
+        return path
+
+    def _write(self, state, path):
+        start = time.perf_counter()
+        tmp = path + ".tmp"
+        torch.save(state, tmp)
+        os.replace(tmp, path)
+        for old in checkpoints(self.directory, self.prefix)[:-self.keep]:
+            os.remove(old)
+        self.write_time += time.perf_counter() - start
+
+    def wait(self):
+        """Block until every queued write is on disk."""
+        for future in self._pending:
+            if future is not None:
+                future.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def report(self):
+        return (f"{self.saves} checkpoints, training blocked {self.stall_time:.3f}s, "
+                f"written in background {self.write_time:.3f}s")
+
+
+def resume(path, trainer, model=None, data=None, map_location="cpu"):
+    """Load a ``Checkpoint`` into ``trainer`` (and ``model``/``data`` as passed to it); returns the state."""
+    state = torch.load(path, map_location=map_location)
+    (model if model is not None else trainer.model).load_state_dict(state["model"])
+    trainer.optimizer.load_state_dict(state["optimizer"])
+    if trainer.scheduler is not None and "scheduler" in state:
+        trainer.scheduler.load_state_dict(state["scheduler"])
+    if trainer.scaler is not None and "scaler" in state:
+        trainer.scaler.load_state_dict(state["scaler"])
+    trainer.epoch = state["epoch"]
+    trainer.global_step = state["global_step"]
+    if data is not None and "data" in state:
+        data.load_state_dict(state["data"])
+        trainer.start_batch = state["data"]["position"]
+    return state
+
+
+class Checkpoint(Callback):
+    """Save model and optimizer state every ``every`` steps (and at the end of each epoch if ``every`` is None).
+
+    Pass ``model`` when the trainer runs a wrapper (compiled, DDP ...) whose
+    ``state_dict`` keys should not end up in the checkpoint, and ``data`` (the
+    ``BatchLoader`` or ``ResumableSampler`` feeding the trainer) to make the
+    checkpoint resumable mid-epoch. With gradient accumulation, pick ``every``
+    as a multiple of ``accumulation_steps``; partial gradients are not saved.
+    """
+
+    def __init__(self, checkpointer, every=None, model=None, data=None):
+        self.checkpointer = checkpointer
+        self.every = every
+        self.model = model
+        self.data = data
+
+    def state(self, trainer, steps, epoch, position):
+        """``steps`` training steps done so far, ``position`` batches into ``epoch``."""
+        model = self.model if self.model is not None else trainer.model
+        state = {
+            "model": model.state_dict(),
+            "optimizer": trainer.optimizer.state_dict(),
+            "epoch": epoch,
+            "global_step": steps,
+        }
+        if trainer.scheduler is not None:
+            state["scheduler"] = trainer.scheduler.state_dict()
+        if trainer.scaler is not None:
+            state["scaler"] = trainer.scaler.state_dict()
+        if self.data is not None:
+            state["data"] = {**self.data.state_dict(), "position": position}
+        return state
+
+    def on_step_end(self, trainer):
+        # global_step and batch_index are incremented after the step's callbacks have run
+        steps = trainer.global_step + 1
+        if self.every and steps % self.every == 0:
+            self.checkpointer.save(self.state(trainer, steps, trainer.epoch, trainer.batch_index + 1), steps)
+
+    def on_epoch_end(self, trainer):
+        if not self.every:
+            state = self.state(trainer, trainer.global_step, trainer.epoch + 1, 0)
+            self.checkpointer.save(state, trainer.global_step)
+
+    def on_fit_end(self, trainer):
+        self.checkpointer.wait()
@@ -0,0 +1,76 @@
+"""Opt-in ``torch.compile`` with a compilation cache that survives restarts.
+
+Inductor's FX graph cache and the AOTAutograd cache are pointed at
+``compile_cache/`` next to this file, so the
+second launch of a script reuses the generated kernels instead of compiling
+again. Ops dynamo cannot trace become graph breaks and run eagerly; with
+``fallback=True`` a failing compile falls back to the eager model as well.
+"""
+import os
+import time
+
+import torch
+
+from trainer import Callback
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compile_cache")
+
+
+def enable_cache(cache_dir=CACHE_DIR):
+    # torch fills in a /tmp default for this variable on first use, so it is set unconditionally
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    import torch._functorch.config
+    import torch._inductor.config
+    torch._inductor.config.fx_graph_cache = True
+    torch._functorch.config.enable_autograd_cache = True
+    return cache_dir
+
+
+def compile_model(model, mode=None, cache_dir=CACHE_DIR, fallback=True):
+    """``torch.compile(model)`` with the persistent cache enabled.
+
+    The returned module shares parameters with ``model``; keep saving
+    ``model.state_dict()``, whose keys are not prefixed with ``_orig_mod.``.
+    """
+    enable_cache(cache_dir)
+    torch._dynamo.config.suppress_errors = fallback
+    return torch.compile(model, mode=mode)
+
+
+def time_first_call(fn, *args):
+    """Run ``fn(*args)`` twice; returns (output, first call seconds, second call seconds)."""
+    start = time.perf_counter()
+    fn(*args)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, first, time.perf_counter() - start
+
+
+class CompileTimer(Callback):
+    """Report the first (compiling) training step separately from steady-state steps.
+
+    Later recompiles, e.g. for a smaller last batch, show up in the steady-state time.
+    """
+
+    def __init__(self):
+        self.compile_time = None
+
+    def on_epoch_start(self, trainer):
+        self.seen = 0.0
+        self.steady_time = 0.0
+        self.steady_steps = 0
+
+    def on_step_end(self, trainer):
+        step_time = trainer.stats.compute_time - self.seen
+        self.seen = trainer.stats.compute_time
+        if self.compile_time is None:
+            self.compile_time = step_time
+            print(f"compile (first step): {self.compile_time:.2f}s")
+        else:
+            self.steady_time += step_time
+            self.steady_steps += 1
+
+    def on_epoch_end(self, trainer):
+        print(f"steady state: {1000 * self.steady_time / max(self.steady_steps, 1):.2f} ms/step")
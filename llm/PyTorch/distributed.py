@@ -0,0 +1,124 @@
+"""Data-parallel CPU training of the Quickstart and CIFAR10 models with DDP over gloo.
+
+    python distributed.py cifar10 --nproc 8                 # 8 ranks on this host
+    python distributed.py quickstart --scaling 1 2 4 8 16   # throughput and efficiency per rank count
+    torchrun --nnodes 2 --nproc-per-node 32 --rdzv-endpoint host:29500 distributed.py cifar10
+
+Every rank trains on its ``DistributedSampler`` shard of the in-memory split
+with the per-rank ``--batch-size`` (weak scaling), and DDP all-reduces the
+gradients in ``--bucket-mb`` buckets while backward is still running. Each
+rank gets ``cores / local ranks`` intra-op threads, so N ranks together use
+the same cores one process would, instead of one process plateauing on
+intra-op parallelism.
+"""
+import argparse
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+
+import fast_data
+from precision_report import build
+from trainer import Throughput, Trainer
+
+
+def _cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def train(rank, world_size, args, local_world_size=None, results=None):
+    """One rank: join the gloo group, train ``args.epochs`` and report global throughput from rank 0."""
+    torch.set_num_threads(args.threads or max(1, _cores() // (local_world_size or world_size)))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        torch.manual_seed(0)  # same initial weights everywhere; DDP also broadcasts rank 0's
+        # each host's local rank 0 downloads and extracts the dataset while the other ranks wait
+        local_rank = int(os.environ.get("LOCAL_RANK", rank))
+        if local_rank != 0:
+            dist.barrier()
+        train_loader, test_loader, model, make_optimizer = build(args.task, args.root, args.batch_size)
+        if local_rank == 0:
+            dist.barrier()
+        sampler = DistributedSampler(train_loader.dataset, world_size, rank, shuffle=True, seed=0)
+        train_loader = fast_data.BatchLoader(train_loader.dataset, args.batch_size, raw=train_loader.raw,
+                                             sampler=sampler)
+        ddp = DistributedDataParallel(model, bucket_cap_mb=args.bucket_mb, gradient_as_bucket_view=True)
+        trainer = Trainer(ddp, nn.CrossEntropyLoss(), make_optimizer(ddp.parameters()),
+                          callbacks=[Throughput()] if rank == 0 and args.verbose else [])
+
+        dist.barrier()
+        samples, start = 0, time.perf_counter()
+        for epoch in range(args.epochs):
+            sampler.set_epoch(epoch)
+            samples += trainer.train_epoch(train_loader).samples
+        elapsed = time.perf_counter() - start
+        totals = torch.tensor([samples, elapsed], dtype=torch.float64)
+        dist.all_reduce(totals[:1])
+        dist.all_reduce(totals[1:], op=dist.ReduceOp.MAX)
+
+        if rank == 0:
+            accuracy = Trainer(ddp.module, nn.CrossEntropyLoss()).evaluate(test_loader)["accuracy"]
+            result = {"ranks": world_size, "samples_per_sec": totals[0].item() / totals[1].item(),
+                      "accuracy": accuracy}
+            if results is not None:
+                results.put(result)
+            else:
+                print(result)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(nproc, args):
+    """Spawn ``nproc`` ranks on this host and return rank 0's result."""
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ["MASTER_PORT"] = str(_free_port())
+    results = mp.get_context("spawn").SimpleQueue()
+    mp.spawn(train, args=(nproc, args, nproc, results), nprocs=nproc, join=True)
+    return results.get()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("task", choices=["quickstart", "cifar10"])
+    parser.add_argument("--nproc", type=int, default=_cores(), help="ranks to spawn on this host")
+    parser.add_argument("--scaling", type=int, nargs="+", help="rank counts to compare, e.g. 1 2 4 8")
+    parser.add_argument("--threads", type=int, help="intra-op threads per rank (default: cores / local ranks)")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64, help="per rank")
+    parser.add_argument("--bucket-mb", type=float, default=25, help="DDP gradient bucket size")
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--verbose", action="store_true", help="print rank 0's step timing every epoch")
+    args = parser.parse_args()
+
+    if "RANK" in os.environ:
+        # started by torchrun, which sets MASTER_ADDR/PORT and the ranks
+        train(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), args,
+              int(os.environ.get("LOCAL_WORLD_SIZE", os.environ["WORLD_SIZE"])))
+    else:
+        # download once up front rather than inside the first timed launch
+        build(args.task, args.root, args.batch_size)
+        print(f"{'ranks':>5} {'threads':>7} {'samples/s':>10} {'speedup':>7} {'efficiency':>10} {'accuracy':>8}")
+        baseline = None
+        for nproc in args.scaling or [args.nproc]:
+            r = launch(nproc, args)
+            per_rank = r["samples_per_sec"] / nproc
+            baseline = baseline or per_rank
+            threads = args.threads or max(1, _cores() // nproc)
+            print(f"{nproc:>5} {threads:>7} {r['samples_per_sec']:>10,.0f} "
+                  f"{r['samples_per_sec'] / baseline:>6.2f}x {100 * per_rank / baseline:>9.1f}% "
+                  f"{100 * r['accuracy']:>7.2f}%")
@@ -0,0 +1,251 @@
+"""Pre-decoded uint8 image stores and batch loaders for the small torchvision datasets.
+
+A store is two ``.npy`` files next to each other:
+
+    <prefix>.images.npy   uint8 [N, C, H, W], one contiguous block
+    <prefix>.labels.npy   int64 [N]
+
+The image file is memory-mapped, so every process that opens the same store
+reads from the same page-cache copy. ``InMemoryDataset`` holds the same layout
+as one tensor in RAM. ``BatchLoader`` slices whole batches out of either and
+converts them to float once per batch instead of once per sample, skipping
+``__getitem__`` and ``default_collate`` entirely.
+"""
+import os
+
+import numpy as np
+import torch
+
+
+def _decoded_arrays(dataset):
+    # FashionMNIST keeps a uint8 tensor [N, H, W], CIFAR10 a numpy array [N, H, W, C]
+    data = dataset.data
+    if isinstance(data, torch.Tensor):
+        data = data.numpy()
+    data = np.asarray(data)
+    if data.ndim == 3:
+        data = data[:, None]
+    else:
+        data = data.transpose(0, 3, 1, 2)
+    images = np.ascontiguousarray(data, dtype=np.uint8)
+    labels = np.asarray(dataset.targets, dtype=np.int64)
+    return images, labels
+
+
+def build_store(dataset, prefix):
+    """Decode a torchvision dataset once and write it as a store at ``prefix``."""
+    images, labels = _decoded_arrays(dataset)
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+    for suffix, array in ((".images.npy", images), (".labels.npy", labels)):
+        # write to a temporary name first so a concurrent reader never sees half a file
+        tmp = f"{prefix}{suffix}.{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=array.dtype, shape=array.shape)
+        out[:] = array
+        out.flush()
+        del out
+        os.replace(tmp, prefix + suffix)
+    return prefix
+
+
+def store_exists(prefix):
+    return os.path.exists(prefix + ".images.npy") and os.path.exists(prefix + ".labels.npy")
+
+
+class MmapStore:
+    """Read-only view of a store. Indexing a single sample mirrors ``ToTensor()``."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        # copy-on-write mapping: pages stay shared, and torch.from_numpy gets a writable array
+        self.images = np.load(prefix + ".images.npy", mmap_mode="c")
+        self.labels = np.load(prefix + ".labels.npy")
+        self.targets = torch.from_numpy(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        image = torch.from_numpy(np.array(self.images[index])).float().div_(255)
+        return image, int(self.labels[index])
+
+
+def open_store(prefix, make_dataset):
+    """Open the store at ``prefix``, building it from ``make_dataset()`` on first use."""
+    if not store_exists(prefix):
+        build_store(make_dataset(), prefix)
+    return MmapStore(prefix)
+
+
+class InMemoryDataset:
+    """A whole split held as one uint8 ``[N, C, H, W]`` tensor plus its labels."""
+
+    def __init__(self, dataset):
+        images, labels = _decoded_arrays(dataset)
+        self.images = torch.from_numpy(images)
+        self.targets = torch.from_numpy(labels)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        return self.images[index].float().div_(255), int(self.targets[index])
+
+
+class SharedMemoryDataset:
+    """Decode every sample of ``dataset`` once into one shared-memory tensor.
+
+    ``__getitem__`` returns views into that tensor, and DataLoader workers get a
+    handle to the segment rather than a pickled or copy-on-write copy of it, so
+    RSS no longer grows with ``num_workers``. The wrapped dataset is not kept.
+
+    A dataset that already holds the split as ``data``/``targets`` tensors
+    (``batch_transforms.RawImages``) is copied in one go; any other is decoded
+    sample by sample.
+    """
+
+    def __init__(self, dataset):
+        data, targets = getattr(dataset, "data", None), getattr(dataset, "targets", None)
+        if isinstance(data, torch.Tensor) and isinstance(targets, torch.Tensor) and len(data) == len(dataset):
+            self.samples = data.clone().share_memory_()
+            self.targets = targets.to(torch.int64, copy=True).share_memory_()
+            return
+        first, _ = dataset[0]
+        first = torch.as_tensor(first)
+        self.samples = torch.empty((len(dataset),) + tuple(first.shape), dtype=first.dtype)
+        self.targets = torch.empty(len(dataset), dtype=torch.int64)
+        for i in range(len(dataset)):
+            sample, target = dataset[i]
+            self.samples[i] = torch.as_tensor(sample)
+            self.targets[i] = int(target)
+        self.samples.share_memory_()
+        self.targets.share_memory_()
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        return self.samples[index], self.targets[index]
+
+
+class BatchLoader:
+    """Minimal DataLoader replacement that yields ``(X, y)`` batches from a store
+    or an ``InMemoryDataset``.
+
+    Batches are cut out of the uint8 block with one slice (or one fancy index
+    with a shuffled permutation) and scaled to float32 in [0, 1] as a single op.
+    With ``raw=True`` the uint8 batch is returned as is, for models that start
+    with a ``batch_transforms.BatchNormalize`` stage.
+
+    A ``sampler`` (e.g. a ``DistributedSampler``) replaces ``shuffle`` as the
+    source of indices; call its ``set_epoch`` as usual.
+
+    ``state_dict`` records the generator state the running epoch was shuffled
+    from; ``load_state_dict`` with a ``position`` (batches already consumed)
+    makes the next iteration redraw the same order and start at that batch.
+    """
+
+    def __init__(self, dataset, batch_size=1, shuffle=False, drop_last=False, seed=None, raw=False, sampler=None):
+        self.dataset = dataset
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.raw = raw
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+        self.epoch = 0
+        self._epoch_state = None
+        self._skip = 0
+
+    def state_dict(self):
+        """The epoch in progress, or the next one between epochs. Positions are tracked by the consumer."""
+        state = self._epoch_state if self._epoch_state is not None else self.generator.get_state()
+        return {"generator": state, "epoch": self.epoch}
+
+    def load_state_dict(self, state):
+        self.generator.set_state(state["generator"])
+        self.epoch = state["epoch"]
+        self._skip = state.get("position", 0)
+
+    def __len__(self):
+        n = len(self.sampler) if self.sampler is not None else len(self.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def _to_batch(self, images):
+        if isinstance(images, np.ndarray):
+            images = torch.from_numpy(np.ascontiguousarray(images))
+        if self.raw:
+            return images
+        return images.float().div_(255)
+
+    def __iter__(self):
+        images, labels = self.dataset.images, self.dataset.targets
+        mapped = isinstance(images, np.ndarray)
+        self._epoch_state = self.generator.get_state()
+        skip, self._skip = self._skip, 0
+        if self.sampler is not None:
+            order = torch.tensor(list(self.sampler), dtype=torch.int64)
+        elif self.shuffle:
+            order = torch.randperm(len(self.dataset), generator=self.generator)
+        else:
+            order = None
+        n = len(order) if order is not None else len(self.dataset)
+        for batch in range(skip, len(self)):
+            start = batch * self.batch_size
+            stop = min(start + self.batch_size, n)
+            if order is None:
+                X = images[start:stop]
+                y = labels[start:stop]
+            else:
+                index = order[start:stop]
+                if mapped:
+                    # sorted indices turn the gather into a forward scan over the mapping
+                    index = index.sort().values
+                    X = images[index.numpy()]
+                else:
+                    X = images[index]
+                y = labels[index]
+            yield self._to_batch(X), y
+        self._epoch_state = None
+        self.epoch += 1
+
+
+class ResumableSampler(torch.utils.data.Sampler):
+    """A shuffling sampler for ``DataLoader`` whose order depends only on ``seed`` and the epoch.
+
+    ``Trainer`` calls ``set_epoch`` at the start of every epoch. After
+    ``load_state_dict`` with a ``position`` in batches of ``batch_size``, the
+    next epoch starts right after those batches instead of at the beginning.
+    """
+
+    def __init__(self, data_source, batch_size=1, seed=0):
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+        self._skip = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+        self._skip = state.get("position", 0) * self.batch_size
+
+    def __len__(self):
+        return max(len(self.data_source) - self._skip, 0)
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator)
+        skip, self._skip = self._skip, 0
+        return iter(order[skip:].tolist())
@@ -0,0 +1,82 @@
+"""Large effective batches from a memory budget, with the learning rate scaled to match.
+
+``plan`` picks the fewest micro-batches whose activations fit the budget and
+splits the target batch evenly between them, rounding the micro-batch up; the
+effective batch is then the target plus at most one sample per micro-batch.
+The learning rate tuned for the small batch is scaled linearly (Goyal et al.)
+or by the square root of the batch ratio, and ramped up from the small-batch
+rate over the first optimizer steps so the early large steps do not diverge.
+"""
+import math
+
+import torch
+
+
+def activation_bytes(model, example):
+    """Rough bytes of activations and their gradients per sample, from the outputs of leaf modules.
+
+    Functional ops (``F.relu`` ...) are not seen, so leave headroom in the budget.
+    """
+    total = 0
+
+    def hook(module, inputs, output):
+        nonlocal total
+        if isinstance(output, torch.Tensor):
+            total += output[:1].numel() * 4  # autograd keeps fp32-sized activations for most ops
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if not list(m.children())]
+    try:
+        with torch.no_grad():
+            model(example[:1])
+    finally:
+        for handle in handles:
+            handle.remove()
+    return 2 * total
+
+
+class BatchPlan:
+    def __init__(self, batch_size, micro_batch_size, accumulation_steps, lr):
+        self.batch_size = batch_size  # effective: micro_batch_size x accumulation_steps
+        self.micro_batch_size = micro_batch_size
+        self.accumulation_steps = accumulation_steps
+        self.lr = lr
+
+    def __str__(self):
+        return f"batch {self.batch_size} = {self.accumulation_steps} x {self.micro_batch_size}, lr {self.lr:g}"
+
+
+def scale_lr(base_lr, base_batch_size, batch_size, rule="linear"):
+    ratio = batch_size / base_batch_size
+    if rule == "linear":
+        return base_lr * ratio
+    if rule == "sqrt":
+        return base_lr * math.sqrt(ratio)
+    raise ValueError(f"unknown scaling rule {rule!r}")
+
+
+def plan(model, example, batch_size, base_lr, base_batch_size, memory_mb=512, rule="linear"):
+    """Micro-batch size, accumulation count and scaled LR for an effective batch of about ``batch_size``.
+
+    Uses as few micro-batches as fit in ``memory_mb`` and sizes them evenly,
+    so an awkward ``batch_size`` (e.g. a prime) is not degraded to many tiny
+    micro-batches. When they do not divide it, the effective batch is rounded
+    up to ``accumulation_steps x micro_batch_size`` and the LR is scaled for that.
+    """
+    per_sample = max(activation_bytes(model, example), 1)
+    fits = max(1, memory_mb * 2**20 // per_sample)
+    steps = math.ceil(batch_size / fits)
+    micro = math.ceil(batch_size / steps)
+    effective = steps * micro
+    return BatchPlan(effective, micro, steps, scale_lr(base_lr, base_batch_size, effective, rule))
+
+
+def warmup(optimizer, warmup_steps, start_factor):
+    """Linear ramp of every param group's lr from ``start_factor`` x to 1 x over ``warmup_steps``.
+
+    Step it once per optimizer step (``Trainer(scheduler=...)`` does).
+    """
+    def factor(step):
+        if step >= warmup_steps:
+            return 1.0
+        return start_factor + (1.0 - start_factor) * step / warmup_steps
+    return torch.optim.lr_scheduler.LambdaLR(optimizer, factor)
@@ -0,0 +1,104 @@
+"""Channels-last execution and oneDNN conv+relu fusion for the ``Net`` CNNs.
+
+In channels-last (NHWC) layout the CPU convolutions run on oneDNN's native
+layout without reordering every batch. For training, pass
+``memory_format=torch.channels_last`` to ``Trainer`` after ``to_channels_last``;
+with ``--compile`` Inductor then fuses the relu into the conv epilogue. For
+inference, ``fuse_for_cpu_inference`` compiles the model with Inductor's
+freezing pass, which constant-folds the weights into prepacked oneDNN convs
+with the relu fused in (``mkldnn._convolution_pointwise(..., 'relu')`` in the
+generated code; ``TORCH_LOGS=output_code`` shows it).
+
+``Net`` flattens with ``torch.flatten`` rather than ``view``: a channels-last
+activation is not contiguous in NCHW order, so ``view`` would fail on it.
+
+    python memory_format.py          # step time of each mode on random CIFAR10-sized batches
+"""
+import argparse
+import time
+
+import torch
+from torch import nn
+
+from compile_mode import enable_cache
+
+
+def to_channels_last(model):
+    return model.to(memory_format=torch.channels_last)
+
+
+@torch.no_grad()
+def fuse_for_cpu_inference(model, example):
+    """Compile ``model`` for CPU inference with conv+relu fused, warmed up on ``example``.
+
+    Inductor's freezing pass treats the weights as constants, so each conv is
+    prepacked once into a oneDNN conv with its relu as a fused post-op. The
+    result is inference-only: later changes to ``model``'s weights are not
+    seen, and the first call with a new batch size compiles once more.
+    """
+    enable_cache()
+    fused = _Frozen(torch.compile(to_channels_last(model).eval()))
+    fused(example.contiguous(memory_format=torch.channels_last))
+    return fused
+
+
+class _Frozen(nn.Module):
+    # freezing is read when a graph is compiled and only applies without grad; setting it
+    # per call rather than globally keeps it away from any other compiled (training) model
+    def __init__(self, compiled):
+        super().__init__()
+        self.compiled = compiled
+
+    def forward(self, x):
+        import torch._inductor.config
+
+        with torch.no_grad(), torch._inductor.config.patch(freezing=True):
+            return self.compiled(x)
+
+
+def _time(fn, steps):
+    fn()
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    return 1000 * (time.perf_counter() - start) / steps
+
+
+def benchmark(batch_size=64, steps=50):
+    from models import Net
+
+    X = torch.rand(batch_size, 3, 32, 32)
+    y = torch.randint(0, 10, (batch_size,))
+    loss_fn = nn.CrossEntropyLoss()
+    results = {}
+    for name, memory_format in (("nchw", torch.contiguous_format), ("channels_last", torch.channels_last)):
+        torch.manual_seed(0)
+        model = Net().to(memory_format=memory_format)
+        optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+        x = X.contiguous(memory_format=memory_format)
+
+        def train_step():
+            loss_fn(model(x), y).backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+        def infer():
+            with torch.no_grad():
+                model(x)
+
+        results[name] = (_time(train_step, steps), _time(infer, steps))
+    fused = fuse_for_cpu_inference(Net(), X)
+    results["fused_inference"] = (None, _time(lambda: fused(X.contiguous(memory_format=torch.channels_last)), steps))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'mode':<16} {'train ms/step':>14} {'infer ms/batch':>15}")
+    for name, (train, infer) in benchmark(args.batch_size, args.steps).items():
+        train = f"{train:.2f}" if train is not None else "-"
+        print(f"{name:<16} {train:>14} {infer:>15.2f}")
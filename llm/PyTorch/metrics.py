@@ -0,0 +1,58 @@
+"""Classification metrics that stay on the device until a report is asked for.
+
+``update`` only does fixed-size tensor ops (one ``index_add_`` into the confusion
+matrix and one add for the loss), so it never forces a host sync. Device
+accumulators are int64 and float32, which every backend (MPS included) supports. ``compute`` copies the
+accumulators back in a single transfer and derives accuracy, per-class
+precision/recall and the confusion matrix from them.
+"""
+import torch
+
+
+class ClassificationMetrics:
+    def __init__(self, num_classes, device="cpu"):
+        self.num_classes = num_classes
+        self.device = torch.device(device)
+        self.reset()
+
+    def reset(self):
+        self.confusion = torch.zeros(self.num_classes * self.num_classes, dtype=torch.int64, device=self.device)
+        self.loss_sum = torch.zeros((), dtype=torch.float32, device=self.device)
+        self.count = 0
+
+    @torch.no_grad()
+    def update(self, logits, targets, loss=None):
+        """Add a batch. ``loss`` is the batch-mean loss tensor, if it should be tracked."""
+        pred = logits.argmax(1)
+        # row = true class, column = predicted class; bincount would read max() back to size its output
+        self.confusion.index_add_(0, targets * self.num_classes + pred, torch.ones_like(pred, dtype=torch.int64))
+        if loss is not None:
+            self.loss_sum += loss.detach().float() * len(targets)
+        self.count += len(targets)
+
+    def compute(self):
+        """Read the accumulators back to the host and return a dict of results."""
+        confusion = self.confusion.cpu().double().view(self.num_classes, self.num_classes)
+        loss_sum = self.loss_sum.cpu().item()
+        count = max(self.count, 1)
+        correct = confusion.diagonal()
+        support = confusion.sum(1)
+        predicted = confusion.sum(0)
+        return {
+            "loss": loss_sum / count,
+            "accuracy": correct.sum().item() / count,
+            "precision": (correct / predicted.clamp(min=1)).tolist(),
+            "recall": (correct / support.clamp(min=1)).tolist(),
+            "support": support.long().tolist(),
+            "confusion": confusion.long(),
+        }
+
+    def report(self, classes=None):
+        results = self.compute()
+        classes = classes or [str(i) for i in range(self.num_classes)]
+        width = max(len(str(c)) for c in classes)
+        lines = [f"{'':>{width}}  precision  recall  support"]
+        for name, p, r, n in zip(classes, results["precision"], results["recall"], results["support"]):
+            lines.append(f"{name:>{width}}  {100 * p:>8.1f}%  {100 * r:>5.1f}%  {n:>7d}")
+        lines.append(f"accuracy {100 * results['accuracy']:.1f}%, avg loss {results['loss']:.6f}")
+        return "\n".join(lines)
@@ -0,0 +1,55 @@
+"""Models shared by the tutorial scripts and the training/serving tools."""
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+
+class NeuralNetwork(nn.Module):
+    """The Quickstart FashionMNIST MLP; ``hidden`` are the widths of its two hidden layers."""
+
+    def __init__(self, hidden=(512, 512)):
+        super().__init__()
+        self.hidden = tuple(hidden)
+        self.flatten = nn.Flatten()
+        self.linear_relu_stack = nn.Sequential(
+            nn.Linear(28*28, self.hidden[0]),
+            nn.ReLU(),
+            nn.Linear(self.hidden[0], self.hidden[1]),
+            nn.ReLU(),
+            nn.Linear(self.hidden[1], 10),
+        )
+
+    @classmethod
+    def for_state_dict(cls, state_dict):
+        """A new model with the hidden widths of ``state_dict``, e.g. one saved by ``prune.py``."""
+        return cls((state_dict["linear_relu_stack.0.weight"].shape[0],
+                    state_dict["linear_relu_stack.2.weight"].shape[0]))
+
+    def forward(self, x):
+        x = self.flatten(x)
+        logits = self.linear_relu_stack(x)
+        return logits
+
+
+class Net(nn.Module):
+    """LeNet-style CNN: 3x32x32 for CIFAR10, ``Net(1, 28)`` for FashionMNIST."""
+
+    def __init__(self, in_channels=3, image_size=32):
+        super(Net, self).__init__()
+        size = ((image_size - 4) // 2 - 4) // 2
+        self.flat_features = 16 * size * size
+        self.conv1 = nn.Conv2d(in_channels, 6, 5)
+        self.pool = nn.MaxPool2d(2, 2)
+        self.conv2 = nn.Conv2d(6, 16, 5)
+        self.fc1 = nn.Linear(self.flat_features, 120)
+        self.fc2 = nn.Linear(120, 84)
+        self.fc3 = nn.Linear(84, 10)
+
+    def forward(self, x):
+        x = self.pool(F.relu(self.conv1(x)))
+        x = self.pool(F.relu(self.conv2(x)))
+        x = torch.flatten(x, 1)
+        x = F.relu(self.fc1(x))
+        x = F.relu(self.fc2(x))
+        x = self.fc3(x)
+        return x
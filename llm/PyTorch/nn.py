@@ -4,6 +4,8 @@ from torch import nn
 from torch.utils.data import dataloader
 from torchvision import datasets, transforms
 
+from models import NeuralNetwork
+
 device = (
     "cuda"
     if torch.cuda.is_available()
@@ -14,23 +16,6 @@ device = (
 
 print(f"Using {device} device")
 
-class NeuralNetwork(nn.Module):
-    def __init__(self):
-        super().__init__()
-        self.flatten = nn.Flatten()
-        self.linear_relu_stack = nn.Sequential(
-            nn.Linear(28*28, 512),
-            nn.ReLU(),
-            nn.Linear(512, 512),
-            nn.ReLU(),
-            nn.Linear(512, 10),
-        )
-
-    def forward(self, x):
-        x = self.flatten(x)
-        logits = self.linear_relu_stack(x)
-        return logits
-    
 model = NeuralNetwork().to(device)
 print(model)
 
@@ -0,0 +1,188 @@
+"""Split the cores between compute threads and DataLoader workers, and pin both.
+
+Without a placement torch starts one intra-op thread per core and every
+DataLoader worker then competes with those threads for the same cores.
+``plan`` takes one NUMA node's cores, gives ``num_workers`` of them to the
+loader workers (one each) and the rest to the compute threads; ``apply`` pins
+the main process to the compute cores and sizes torch's thread pools to match,
+and ``worker_init`` pins each worker to its own core. Pinning to one node also
+keeps first-touch allocations on that node's memory; where libnuma is
+available the node is additionally made the preferred allocation node.
+
+    python placement.py --workers 2      # step time under each placement, one subprocess each
+
+Linux only; elsewhere ``apply`` just sets the thread counts.
+"""
+import argparse
+import ctypes
+import glob
+import os
+import subprocess
+import sys
+import time
+
+import torch
+from torch import nn
+
+
+def parse_cpulist(text):
+    """``"0-3,8,10-11"`` -> ``[0, 1, 2, 3, 8, 10, 11]``."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.extend(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes():
+    """``{node: [cpu, ...]}`` for the CPUs this process may run on; one node if there is no NUMA info."""
+    allowed = set(available_cpus())
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path) as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in allowed]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+class Placement:
+    def __init__(self, compute_cpus, worker_cpus, node=None, interop_threads=1):
+        self.compute_cpus = list(compute_cpus)
+        self.worker_cpus = list(worker_cpus)
+        self.node = node
+        self.interop_threads = interop_threads
+
+    def __repr__(self):
+        return (f"Placement(node={self.node}, compute={self.compute_cpus}, workers={self.worker_cpus}, "
+                f"interop={self.interop_threads})")
+
+    def apply(self):
+        """Pin this process to the compute cores and size torch's thread pools; call before any torch work."""
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.compute_cpus)
+        torch.set_num_threads(len(self.compute_cpus))
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError:
+            pass  # only settable once, before the first inter-op work
+        if self.node is not None:
+            prefer_numa_node(self.node)
+        return self
+
+    def worker_init(self, worker_id):
+        """``DataLoader(worker_init_fn=placement.worker_init)``: one core and one thread per worker."""
+        if self.worker_cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, [self.worker_cpus[worker_id % len(self.worker_cpus)]])
+        torch.set_num_threads(1)
+
+
+def plan(num_workers=0, node=None):
+    """A placement on ``node`` (default: the one with most usable cores).
+
+    Workers get a core each, taken from the end of the node's list, while at
+    least one core is left for compute; past that they share the worker cores.
+    """
+    nodes = numa_nodes()
+    if node is None:
+        node = max(nodes, key=lambda n: len(nodes[n]))
+    cpus = nodes[node]
+    reserved = min(num_workers, len(cpus) - 1)
+    compute, workers = cpus[:len(cpus) - reserved], cpus[len(cpus) - reserved:]
+    if num_workers and not workers:
+        workers = compute[-1:]  # a single core: workers share the last compute core
+    return Placement(compute, workers, node if len(nodes) > 1 else None)
+
+
+def prefer_numa_node(node):
+    """Make ``node`` the preferred node for new allocations via libnuma; returns False if unavailable."""
+    try:
+        libnuma = ctypes.CDLL("libnuma.so.1")
+    except OSError:
+        return False
+    if libnuma.numa_available() < 0:
+        return False
+    libnuma.numa_set_preferred(node)
+    return True
+
+
+class _AugmentedImages(torch.utils.data.Dataset):
+    """CIFAR10-shaped uint8 images with a per-sample random crop and flip, to give workers real work."""
+
+    def __init__(self, n=4096):
+        generator = torch.Generator().manual_seed(0)
+        self.images = torch.randint(0, 256, (n, 3, 40, 40), dtype=torch.uint8, generator=generator)
+        self.targets = torch.randint(0, 10, (n,), generator=generator)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        i, j = torch.randint(0, 9, (2,)).tolist()
+        image = self.images[index, :, i:i + 32, j:j + 32]
+        if torch.rand(()) < 0.5:
+            image = image.flip(-1)
+        return image.float().div_(255), self.targets[index]
+
+
+def _run(mode, workers, batch_size, steps):
+    placement = plan(workers) if mode != "default" else None
+    if mode == "threads":
+        torch.set_num_threads(len(placement.compute_cpus))
+    elif mode == "pinned":
+        placement.apply()
+
+    from models import Net
+
+    torch.manual_seed(0)
+    model = Net()
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3, momentum=0.9)
+    loss_fn = nn.CrossEntropyLoss()
+    loader = torch.utils.data.DataLoader(
+        _AugmentedImages(), batch_size=batch_size, shuffle=True, num_workers=workers,
+        worker_init_fn=placement.worker_init if mode == "pinned" else None, persistent_workers=workers > 0)
+    times = []
+    while len(times) < steps:
+        for X, y in loader:
+            start = time.perf_counter()
+            loss_fn(model(X), y).backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            times.append(time.perf_counter() - start)
+            if len(times) == steps:
+                break
+    times = sorted(times[steps // 10:])  # drop warmup steps
+    return torch.get_num_threads(), 1000 * times[len(times) // 2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--run", choices=["default", "threads", "pinned"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        threads, step_ms = _run(args.run, args.workers, args.batch_size, args.steps)
+        print(threads, step_ms)
+        sys.exit()
+
+    print(f"nodes: {numa_nodes()}\nplan: {plan(args.workers)}")
+    print(f"{'placement':<10} {'threads':>7} {'median step ms':>14}")
+    for mode in ("default", "threads", "pinned"):
+        # one process per placement: affinity and inter-op threads cannot be undone
+        out = subprocess.run([sys.executable, __file__, "--run", mode, "--workers", str(args.workers),
+                              "--batch-size", str(args.batch_size), "--steps", str(args.steps)],
+                             capture_output=True, text=True, check=True).stdout.split()
+        print(f"{mode:<10} {out[-2]:>7} {float(out[-1]):>14.2f}")
@@ -0,0 +1,97 @@
+"""Accuracy and throughput of bf16 autocast against the fp32 baseline.
+
+    python precision_report.py --models quickstart cifar10 --epochs 2
+
+Each model is trained from the same initial weights once per precision with
+the ``Trainer``, then evaluated on the test split. bf16 only pays off on CPUs
+with native bf16 support (AVX512-BF16 or AMX); elsewhere it is emulated and
+usually slower than fp32, which the report header points out.
+"""
+import argparse
+import copy
+import time
+
+import torch
+from torch import nn
+from torchvision import datasets
+
+import fast_data
+from batch_transforms import normalized
+from models import NeuralNetwork, Net
+from trainer import Trainer
+
+
+def cpu_bf16_support():
+    """The CPU flags relevant to bf16 (Linux only; empty elsewhere)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line.split(":", 1)[1].split() for line in f if line.startswith("flags")), [])
+    except OSError:
+        return []
+    return [flag for flag in ("avx512_bf16", "amx_bf16", "amx_tile") if flag in flags]
+
+
+def build(task, root, batch_size):
+    """Loaders, an initial model and an optimizer factory, matching each script's setup."""
+    if task == "quickstart":
+        train = fast_data.InMemoryDataset(datasets.FashionMNIST(root, train=True, download=True))
+        test = fast_data.InMemoryDataset(datasets.FashionMNIST(root, train=False, download=True))
+        raw, model = False, NeuralNetwork()
+        make_optimizer = lambda params: torch.optim.SGD(params, lr=1e-3)
+    elif task == "cifar10":
+        train = fast_data.InMemoryDataset(datasets.CIFAR10(root, train=True, download=True))
+        test = fast_data.InMemoryDataset(datasets.CIFAR10(root, train=False, download=True))
+        raw, model = True, normalized(Net(), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+        make_optimizer = lambda params: torch.optim.SGD(params, lr=0.001, momentum=0.9)
+    else:
+        raise ValueError(f"unknown task {task!r}")
+    train_loader = fast_data.BatchLoader(train, batch_size=batch_size, shuffle=True, seed=0, raw=raw)
+    test_loader = fast_data.BatchLoader(test, batch_size=batch_size, raw=raw)
+    return train_loader, test_loader, model, make_optimizer
+
+
+def run(initial, make_optimizer, train_loader, test_loader, precision, epochs, device):
+    model = copy.deepcopy(initial).to(device)
+    trainer = Trainer(model, nn.CrossEntropyLoss(), make_optimizer(model.parameters()), device,
+                      sync_timing=True, precision=precision)
+    train_loader.generator.manual_seed(0)
+    samples = seconds = 0
+    for _ in range(epochs):
+        stats = trainer.train_epoch(train_loader)
+        samples += stats.samples
+        seconds += stats.total_time
+    start = time.perf_counter()
+    results = trainer.evaluate(test_loader)
+    eval_seconds = time.perf_counter() - start
+    return {
+        "accuracy": results["accuracy"],
+        "loss": results["loss"],
+        "train": samples / seconds,
+        "eval": len(test_loader.dataset) / eval_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=["quickstart", "cifar10"], default=["quickstart", "cifar10"])
+    parser.add_argument("--precisions", nargs="+", choices=["fp32", "bf16", "fp16"], default=["fp32", "bf16"])
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    flags = cpu_bf16_support()
+    print(f"CPU capability: {torch.backends.cpu.get_cpu_capability()}, "
+          f"bf16 flags: {' '.join(flags) if flags else 'none (bf16 will be emulated)'}")
+    print(f"{'model':<11} {'precision':<9} {'accuracy':>8} {'loss':>8} "
+          f"{'train/s':>10} {'eval/s':>10} {'train x':>7} {'eval x':>7}")
+    for task in args.models:
+        train_loader, test_loader, initial, make_optimizer = build(task, args.root, args.batch_size)
+        baseline = None
+        for precision in args.precisions:
+            r = run(initial, make_optimizer, train_loader, test_loader, precision, args.epochs, args.device)
+            baseline = baseline or r
+            print(f"{task:<11} {precision:<9} {100 * r['accuracy']:>7.2f}% {r['loss']:>8.4f} "
+                  f"{r['train']:>10,.0f} {r['eval']:>10,.0f} "
+                  f"{r['train'] / baseline['train']:>6.2f}x {r['eval'] / baseline['eval']:>6.2f}x")
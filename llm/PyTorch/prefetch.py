@@ -0,0 +1,110 @@
+"""Double-buffered batch prefetching.
+
+``Prefetcher`` wraps any loader and prepares batch N+1 on a background thread
+while the training loop computes on batch N. On CUDA the thread pins the
+batch and issues a non-blocking copy on a side stream, so the copy overlaps
+with the kernels of the previous step as well. The time the loop spent waiting
+for a batch is kept in ``stall_time``.
+"""
+import queue
+import threading
+import time
+
+import torch
+
+_DONE = object()
+
+
+def _map(batch, fn):
+    if isinstance(batch, torch.Tensor):
+        return fn(batch)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_map(b, fn) for b in batch)
+    return batch
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Prefetcher:
+    """Iterate ``loader`` with up to ``depth`` batches prepared ahead, already on ``device``."""
+
+    def __init__(self, loader, device="cpu", depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.stall_time = 0.0
+        self.batches = 0
+        self.stream = torch.cuda.Stream() if self.device.type == "cuda" else None
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _to_device(self, batch):
+        if self.stream is None:
+            return _map(batch, lambda t: t.to(self.device)), None
+        with torch.cuda.stream(self.stream):
+            batch = _map(batch, lambda t: t.pin_memory().to(self.device, non_blocking=True))
+            ready = torch.cuda.Event()
+            ready.record(self.stream)
+        return batch, ready
+
+    @staticmethod
+    def _put(out, stop, item):
+        # give up if the consumer has gone away, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, out, stop):
+        try:
+            for batch in self.loader:
+                if not self._put(out, stop, self._to_device(batch)):
+                    return
+            self._put(out, stop, _DONE)
+        except Exception as e:
+            self._put(out, stop, _Failure(e))
+
+    def __iter__(self):
+        out = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(out, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = out.get()
+                self.stall_time += time.perf_counter() - start
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                batch, ready = item
+                if ready is not None:
+                    current = torch.cuda.current_stream()
+                    current.wait_event(ready)
+                    # the batch was allocated on the side stream; keep it alive for this one
+                    _map(batch, lambda t: t.record_stream(current))
+                self.batches += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def reset_stats(self):
+        self.stall_time = 0.0
+        self.batches = 0
+
+    def report(self):
+        return (f"data stall: {self.stall_time:.3f}s over {self.batches} batches "
+                f"({1000 * self.stall_time / max(self.batches, 1):.2f} ms/batch)")
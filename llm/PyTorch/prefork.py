@@ -0,0 +1,263 @@
+"""Pre-fork serving: load the weights once, fork N workers that use them in place.
+
+The parent loads the model before forking. A ``.safetensors`` file is mapped
+(every worker reads the same page-cache pages); any other weights are moved
+into shared memory with ``share_memory()``. Forked workers then use the same
+physical pages, so weight memory stays flat as workers are added. Each worker
+runs ``serve.DynamicBatcher`` with its share of the cores as intra-op threads.
+
+Two routers spread the requests:
+
+* ``shared`` (default): every worker accepts on the one listening socket the
+  parent opened, and the kernel hands each new connection to an idle worker.
+* ``proxy``: the parent forwards every request to the worker with the fewest
+  requests in flight, over keep-alive Unix sockets. It balances per request
+  rather than per connection, at the cost of one extra hop.
+
+    python prefork.py serve --model cifar10 --weights cifar_net.pth --workers 4
+    python prefork.py bench --model quickstart --workers 1 2 4 8      # req/s, p99 and worker memory per N
+
+The parent must not run an OpenMP parallel region before the fork, since the
+thread pool does not survive it; ``shared_model`` builds the model with one
+intra-op thread for that reason.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import torch
+
+import serve
+from batch_transforms import normalized
+from models import NeuralNetwork, Net
+
+CIFAR10_CLASSES = ["plane", "car", "bird", "cat", "deer", "dog", "frog", "horse", "ship", "truck"]
+
+
+class ModelSpec:
+    def __init__(self, make_model, shape, classes, raw):
+        self.make_model = make_model
+        self.shape = shape
+        self.classes = classes
+        self.raw = raw
+
+
+MODELS = {
+    "quickstart": ModelSpec(NeuralNetwork, (1, 28, 28), serve.CLASSES, raw=False),
+    # the CIFAR10.py network: raw uint8 in, normalization is its first layer
+    "cifar10": ModelSpec(lambda: normalized(Net(), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)), (3, 32, 32),
+                         CIFAR10_CLASSES, raw=True),
+}
+
+
+def shared_model(spec, path=None):
+    """Load ``spec``'s model for sharing with forked workers.
+
+    Sets the parent to one intra-op thread first: building and loading the
+    model runs parallel regions otherwise, and workers forked after that hang
+    on their first forward pass. Each worker sets its own count in ``_worker``.
+    """
+    torch.set_num_threads(1)
+    model = serve.load_model(path, spec.make_model)
+    if path is None or not path.endswith(".safetensors"):
+        model.share_memory()
+    return model
+
+
+def _worker(model, spec, threads, max_batch, max_latency_ms, listener=None, unix_socket=None):
+    torch.set_num_threads(threads)
+    batcher = serve.DynamicBatcher(model, max_batch, max_latency_ms, raw=spec.raw)
+    server = serve.make_server(batcher.predict, batcher.stats, listener=listener, unix_socket=unix_socket,
+                               shape=spec.shape, classes=spec.classes)
+    server.serve_forever()
+
+
+class Router:
+    """Forward each request to the worker with the fewest requests in flight."""
+
+    def __init__(self, sockets):
+        self.sockets = sockets
+        self.in_flight = [0] * len(sockets)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self, worker):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if worker not in connections:
+            connections[worker] = serve.UnixHTTPConnection(self.sockets[worker])
+        return connections[worker]
+
+    def forward(self, method, path, body=None, headers=None, worker=None):
+        if worker is None:
+            with self._lock:
+                worker = min(range(len(self.sockets)), key=self.in_flight.__getitem__)
+                self.in_flight[worker] += 1
+        else:
+            with self._lock:
+                self.in_flight[worker] += 1
+        try:
+            conn = self._connection(worker)
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response.status, response.getheader("Content-Type"), response.read()
+        finally:
+            with self._lock:
+                self.in_flight[worker] -= 1
+
+
+class _RouterHandler(serve.Handler):
+    def _forward(self, method, body=None):
+        status, content_type, payload = self.server.router.forward(
+            method, self.path, body, {"Content-Type": self.headers.get("Content-Type", "application/octet-stream")})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type or "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self._forward("POST", self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._reply(200, self.server.stats())
+        self._forward("GET")
+
+
+class PreforkServer:
+    def __init__(self, model, spec, workers=os.cpu_count(), router="shared", host="127.0.0.1", port=8000,
+                 max_batch=64, max_latency_ms=2.0, threads=None):
+        self.model = model
+        self.spec = spec
+        self.workers = workers
+        self.router = router
+        self.address = (host, port)
+        self.max_batch = max_batch
+        self.max_latency_ms = max_latency_ms
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.processes = []
+        self._server = None
+
+    def start(self):
+        context = mp.get_context("fork")
+        options = (self.model, self.spec, self.threads, self.max_batch, self.max_latency_ms)
+        if self.router == "shared":
+            listener = socket.create_server(self.address, backlog=1024)
+            targets = [dict(listener=listener)] * self.workers
+        else:
+            self._run_dir = tempfile.mkdtemp(prefix="prefork-")
+            sockets = [os.path.join(self._run_dir, f"worker-{i}.sock") for i in range(self.workers)]
+            targets = [dict(unix_socket=path) for path in sockets]
+        for target in targets:
+            process = context.Process(target=_worker, args=options, kwargs=target, daemon=True)
+            process.start()
+            self.processes.append(process)
+        if self.router == "shared":
+            listener.close()  # the workers hold their own copies
+        else:
+            self._wait_for(sockets)
+            router = Router(sockets)
+            self._server = serve.make_server(None, self.stats, *self.address, handler=_RouterHandler)
+            self._server.router = router
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @staticmethod
+    def _wait_for(sockets, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not all(os.path.exists(path) for path in sockets):
+            if time.monotonic() > deadline:
+                raise TimeoutError("workers did not come up")
+            time.sleep(0.01)
+
+    def stats(self):
+        """Per-worker ``/stats`` (proxy router only; with ``shared`` each connection sees one worker)."""
+        if self._server is None:
+            return {}
+        router = self._server.router
+        workers = [json.loads(router.forward("GET", "/stats", worker=i)[2]) for i in range(self.workers)]
+        return {
+            "requests_per_sec": sum(w["requests_per_sec"] for w in workers),
+            "p99_ms": max(w["p99_ms"] for w in workers),
+            "workers": workers,
+        }
+
+    def memory(self):
+        """Summed PSS and private memory of the workers in MB, from ``/proc/<pid>/smaps_rollup`` (Linux)."""
+        totals = {"Pss": 0, "Private_Clean": 0, "Private_Dirty": 0}
+        for process in self.processes:
+            try:
+                with open(f"/proc/{process.pid}/smaps_rollup") as f:
+                    for line in f:
+                        key, _, value = line.partition(":")
+                        if key in totals:
+                            totals[key] += int(value.split()[0])
+            except OSError:
+                return None
+        return {"pss_mb": totals["Pss"] / 1024,
+                "private_mb": (totals["Private_Clean"] + totals["Private_Dirty"]) / 1024}
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "bench"):
+        sub = commands.add_parser(name)
+        sub.add_argument("--model", choices=list(MODELS), default="quickstart")
+        sub.add_argument("--weights", help="state dict (.pth) or flat .safetensors; random weights if omitted")
+        sub.add_argument("--router", choices=["shared", "proxy"], default="shared")
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=8000)
+        sub.add_argument("--threads", type=int, help="intra-op threads per worker (default: cores / workers)")
+        sub.add_argument("--max-batch", type=int, default=64)
+        sub.add_argument("--max-latency-ms", type=float, default=2.0)
+        if name == "serve":
+            sub.add_argument("--workers", type=int, default=os.cpu_count())
+        else:
+            sub.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+            sub.add_argument("--requests", type=int, default=10_000)
+            sub.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    spec = MODELS[args.model]
+    model = shared_model(spec, args.weights)
+    options = dict(router=args.router, host=args.host, port=args.port, max_batch=args.max_batch,
+                   max_latency_ms=args.max_latency_ms, threads=args.threads)
+    if args.command == "serve":
+        server = PreforkServer(model, spec, args.workers, **options).start()
+        print(f"{args.workers} workers serving {args.model} on http://{args.host}:{args.port} ({args.router} router)")
+        try:
+            for process in server.processes:
+                process.join()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        print(f"{'workers':>7} {'req/s':>10} {'p50 ms':>7} {'p99 ms':>7} {'PSS MB':>8} {'private MB':>10}")
+        for workers in args.workers:
+            server = PreforkServer(model, spec, workers, **options).start()
+            try:
+                address = dict(host=args.host, port=args.port, shape=spec.shape)
+                serve.load_test(min(args.requests, 500), args.concurrency, **address)  # warm up every worker
+                r = serve.load_test(args.requests, args.concurrency, **address)
+                memory = server.memory() or {"pss_mb": float("nan"), "private_mb": float("nan")}
+            finally:
+                server.stop()
+            print(f"{workers:>7} {r['requests_per_sec']:>10,.0f} {r['p50_ms']:>7.2f} {r['p99_ms']:>7.2f} "
+                  f"{memory['pss_mb']:>8.1f} {memory['private_mb']:>10.1f}")
@@ -0,0 +1,144 @@
+"""Structured pruning of the Quickstart MLP's hidden layers into smaller dense layers.
+
+    python prune.py model.pth --step 0.25 --max-drop 1.0      # -> model_pruned.pth
+
+Each round scores every hidden neuron by the norm of its incoming weights and
+bias times the norm of its outgoing weights, drops the lowest ``--step``
+fraction of each hidden layer, and fine-tunes the result for
+``--finetune-epochs``. Rounds continue until accuracy on a held-out slice
+of the training set (``--valid-fraction``) falls below the floor
+(``--floor``, or the original validation accuracy minus ``--max-drop``
+points); the last model above it is kept. The test split plays no part in
+that choice and is only evaluated for the original and the kept model.
+
+Removed neurons are cut out of the weight matrices, not masked: the result is
+a ``NeuralNetwork`` with narrower ``nn.Linear`` layers, so FLOPs, memory and
+latency shrink with it. ``NeuralNetwork.for_state_dict`` rebuilds it from the
+saved state dict, and ``quantize.py dynamic`` accepts it as well.
+"""
+import argparse
+
+import torch
+from torch import nn
+from torchvision import datasets
+
+import fast_data
+from models import NeuralNetwork
+from quantize import latency_ms
+from trainer import Trainer
+
+
+def linear_layers(model):
+    return [m for m in model.linear_relu_stack if isinstance(m, nn.Linear)]
+
+
+def neuron_scores(incoming, outgoing):
+    """Importance of each output neuron of ``incoming``, whose outputs feed ``outgoing``."""
+    fan_in = torch.cat([incoming.weight, incoming.bias[:, None]], dim=1).norm(dim=1)
+    fan_out = outgoing.weight.norm(dim=0)
+    return fan_in * fan_out
+
+
+@torch.no_grad()
+def prune(model, fraction):
+    """A new ``NeuralNetwork`` without the lowest-scoring ``fraction`` of each hidden layer's neurons."""
+    layers = linear_layers(model)
+    keep = []
+    for incoming, outgoing in zip(layers, layers[1:]):
+        scores = neuron_scores(incoming, outgoing)
+        width = max(1, round(len(scores) * (1 - fraction)))
+        keep.append(scores.topk(width).indices.sort().values)
+
+    pruned = NeuralNetwork(hidden=[len(k) for k in keep])
+    rows = keep + [None]  # the output layer keeps all 10 classes
+    cols = [None] + keep  # the input layer keeps all 784 pixels
+    for source, target, row, col in zip(layers, linear_layers(pruned), rows, cols):
+        weight, bias = source.weight, source.bias
+        if row is not None:
+            weight, bias = weight[row], bias[row]
+        if col is not None:
+            weight = weight[:, col]
+        target.weight.copy_(weight)
+        target.bias.copy_(bias)
+    return pruned
+
+
+def parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def flops(model):
+    """Multiply-adds x 2 of one forward pass per sample."""
+    return sum(2 * layer.in_features * layer.out_features for layer in linear_layers(model))
+
+
+def evaluate(model, test_loader):
+    return Trainer(model, nn.CrossEntropyLoss()).evaluate(test_loader)["accuracy"]
+
+
+def finetune(model, train_loader, epochs, lr):
+    optimizer = torch.optim.SGD(model.parameters(), lr=lr, momentum=0.9)
+    Trainer(model, nn.CrossEntropyLoss(), optimizer).fit(train_loader, epochs=epochs)
+    return model
+
+
+def split(n, valid_fraction, seed=0):
+    """Shuffled training and validation index lists over ``n`` samples."""
+    order = torch.randperm(n, generator=torch.Generator().manual_seed(seed)).tolist()
+    cut = round(n * valid_fraction)
+    return order[cut:], sorted(order[:cut])
+
+
+def print_row(label, model, accuracy, example):
+    print(f"{label:<8} {str(list(model.hidden)):<12} {parameters(model):>10,} {flops(model) / 1e6:>8.2f} "
+          f"{100 * accuracy:>8.2f}% {latency_ms(model.eval(), example):>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("weights", nargs="?", default="model.pth")
+    parser.add_argument("--output", default="model_pruned.pth")
+    parser.add_argument("--step", type=float, default=0.25, help="fraction of each hidden layer removed per round")
+    parser.add_argument("--max-drop", type=float, default=1.0,
+                        help="validation accuracy points below the original allowed")
+    parser.add_argument("--valid-fraction", type=float, default=0.1,
+                        help="share of the training set held out to choose the pruning level")
+    parser.add_argument("--floor", type=float, help="absolute accuracy floor in percent (overrides --max-drop)")
+    parser.add_argument("--finetune-epochs", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--max-rounds", type=int, default=20)
+    parser.add_argument("--root", default="data")
+    args = parser.parse_args()
+
+    state = torch.load(args.weights, map_location="cpu")
+    model = NeuralNetwork.for_state_dict(state)
+    model.load_state_dict(state)
+    train = fast_data.InMemoryDataset(datasets.FashionMNIST(args.root, train=True, download=True))
+    test = fast_data.InMemoryDataset(datasets.FashionMNIST(args.root, train=False, download=True))
+    train_indices, valid_indices = split(len(train), args.valid_fraction)
+    train_loader = fast_data.BatchLoader(train, batch_size=64, sampler=torch.utils.data.SubsetRandomSampler(
+        train_indices, generator=torch.Generator().manual_seed(0)))
+    valid_loader = fast_data.BatchLoader(train, batch_size=64, sampler=valid_indices)
+    test_loader = fast_data.BatchLoader(test, batch_size=64)
+    example = next(iter(test_loader))[0]
+
+    accuracy = evaluate(model, valid_loader)
+    floor = args.floor / 100 if args.floor is not None else accuracy - args.max_drop / 100
+    print(f"validation accuracy floor {100 * floor:.2f}% ({len(valid_indices):,} held-out training samples)")
+    print(f"{'round':<8} {'hidden':<12} {'params':>10} {'MFLOPs':>8} {'valid acc':>9} {'b64 ms':>8}")
+    print_row("original", model, accuracy, example)
+
+    best = model
+    for round_ in range(1, args.max_rounds + 1):
+        candidate = finetune(prune(best, args.step), train_loader, args.finetune_epochs, args.lr)
+        accuracy = evaluate(candidate, valid_loader)
+        print_row(str(round_), candidate, accuracy, example)
+        if accuracy < floor or candidate.hidden == best.hidden:
+            break
+        best = candidate
+
+    torch.save(best.state_dict(), args.output)
+    print(f"kept hidden widths {list(best.hidden)}: {parameters(best):,} parameters "
+          f"({100 * parameters(best) / parameters(model):.0f}% of the original), saved to {args.output}")
+    print(f"test accuracy: original {100 * evaluate(model, test_loader):.2f}%, "
+          f"pruned {100 * evaluate(best, test_loader):.2f}%")
@@ -0,0 +1,240 @@
+"""Post-training int8 quantization of the tutorial models, with an fp32 comparison table.
+
+    python quantize.py dynamic model.pth                # Quickstart MLP -> model_int8.pt
+    python quantize.py static cifar_net.pth             # CIFAR10 Net -> cifar_net_int8.pt
+    python quantize.py static cifar_net.pth --qat-epochs 2 --max-drop 0.5
+
+``dynamic`` replaces every ``nn.Linear`` with an int8-weight version that
+quantizes its activations on the fly, so it needs no calibration data.
+
+``static`` quantizes weights and activations of the whole CIFAR10 ``Net``
+through FX graph mode: conv+relu and linear+relu are fused into single int8
+modules, and activation ranges are calibrated on a sample of the training
+set. If that loses more than ``--max-drop`` accuracy points (or ``--qat``
+forces it), the float model is fine-tuned with fake quantization (QAT) for
+``--qat-epochs`` and converted again.
+
+Quantized models are saved as TorchScript and load with ``torch.jit.load``
+without the model classes. The table reports test accuracy, serialized size
+and median batch-1/batch-64 CPU latency for fp32 and int8.
+"""
+import argparse
+import contextlib
+import copy
+import io
+import os
+import time
+import warnings
+
+import torch
+from torch import nn
+from torchvision import datasets
+
+import fast_data
+from batch_transforms import normalized
+from models import NeuralNetwork, Net
+from trainer import Throughput, Trainer
+
+CIFAR10_MEAN, CIFAR10_STD = (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)
+
+
+@contextlib.contextmanager
+def _quiet():
+    # torch.ao.quantization and TorchScript warn about their deprecation on every call
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=DeprecationWarning)
+        warnings.simplefilter("ignore", category=FutureWarning)
+        warnings.simplefilter("ignore", category=UserWarning)
+        yield
+
+
+def select_engine():
+    """Use the x86 (fbgemm) kernels where available, qnnpack on ARM."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"no quantized engine available (have {engines})")
+
+
+def quantize_dynamic(model):
+    with _quiet():
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration, batches=32):
+    """FX-quantize ``model`` (float inputs) to int8, calibrating on ``batches`` inputs from ``calibration``."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = next(iter(calibration))
+    with _quiet():
+        prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(torch.backends.quantized.engine),
+                              example_inputs=(example,))
+        with torch.inference_mode():
+            for i, X in enumerate(calibration):
+                if i == batches:
+                    break
+                prepared(X)
+        return convert_fx(prepared)
+
+
+def prepare_qat(model, example):
+    """``model`` with fake-quantize observers inserted and conv/linear+relu fused, ready to fine-tune."""
+    from torch.ao.quantization import get_default_qat_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_qat_fx
+
+    with _quiet():
+        return prepare_qat_fx(copy.deepcopy(model).train(),
+                              get_default_qat_qconfig_mapping(torch.backends.quantized.engine),
+                              example_inputs=(example,))
+
+
+def convert_qat(prepared):
+    from torch.ao.quantization.quantize_fx import convert_fx
+
+    with _quiet():
+        return convert_fx(copy.deepcopy(prepared).eval())
+
+
+def save_artifact(model, path, example=None):
+    """TorchScript ``model`` to ``path``: traced on ``example`` if given, scripted otherwise."""
+    with _quiet():
+        scripted = torch.jit.trace(model, example) if example is not None else torch.jit.script(model)
+        torch.jit.save(scripted, path)
+
+
+def serialized_size(model):
+    buffer = io.BytesIO()
+    with _quiet():
+        torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def latency_ms(model, example, repeat=100):
+    """Median latency of one forward pass on ``example``."""
+    times = []
+    with torch.inference_mode():
+        for _ in range(10):
+            model(example)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(example)
+            times.append(time.perf_counter() - start)
+    return 1000 * sorted(times)[len(times) // 2]
+
+
+def report(name, model, test_loader, example):
+    with _quiet():
+        accuracy = Trainer(model, nn.CrossEntropyLoss()).evaluate(test_loader)["accuracy"]
+    return {
+        "model": name,
+        "accuracy": accuracy,
+        "size": serialized_size(model),
+        "b1": latency_ms(model, example[:1]),
+        "b64": latency_ms(model, example),
+    }
+
+
+def print_table(rows):
+    base = rows[0]
+    print(f"{'model':<14} {'accuracy':>8} {'size MB':>8} {'b1 ms':>7} {'b64 ms':>7} {'b1 x':>6} {'b64 x':>6}")
+    for r in rows:
+        print(f"{r['model']:<14} {100 * r['accuracy']:>7.2f}% {r['size'] / 2**20:>8.2f} "
+              f"{r['b1']:>7.3f} {r['b64']:>7.3f} {base['b1'] / r['b1']:>5.2f}x {base['b64'] / r['b64']:>5.2f}x")
+
+
+def fashion_mnist_test(root, batch_size=64):
+    test = fast_data.InMemoryDataset(datasets.FashionMNIST(root, train=False, download=True))
+    return fast_data.BatchLoader(test, batch_size=batch_size)
+
+
+def run_dynamic(args):
+    state = torch.load(args.weights, map_location="cpu")
+    model = NeuralNetwork.for_state_dict(state)  # also fits a model slimmed by prune.py
+    model.load_state_dict(state)
+    model.eval()
+    test_loader = fashion_mnist_test(args.root)
+    example = next(iter(test_loader))[0]
+
+    quantized = quantize_dynamic(model)
+    save_artifact(quantized, args.output)
+    rows = [report("fp32", model, test_loader, example),
+            report("int8 dynamic", quantized, test_loader, example)]
+    print_table(rows)
+    print(f"saved {args.output} ({os.path.getsize(args.output) / 2**20:.2f} MB)")
+
+
+class _Normalized:
+    """The raw uint8 batches of ``loader`` through ``BatchNormalize``: the float inputs ``Net`` sees."""
+
+    def __init__(self, loader, normalize):
+        self.loader = loader
+        self.normalize = normalize
+
+    def __iter__(self):
+        for X, _ in self.loader:
+            yield self.normalize(X)
+
+
+def run_static(args):
+    # CIFAR10.py trains normalized(Net()): BatchNormalize on raw uint8, then the CNN.
+    # Only the CNN is quantized; normalization stays a float op in front of it.
+    model = normalized(Net(), CIFAR10_MEAN, CIFAR10_STD)
+    model.load_state_dict(torch.load(args.weights, map_location="cpu"))
+    model.eval()
+    normalize, net = model[0], model[1]
+
+    train = fast_data.InMemoryDataset(datasets.CIFAR10(args.root, train=True, download=True))
+    test = fast_data.InMemoryDataset(datasets.CIFAR10(args.root, train=False, download=True))
+    train_loader = fast_data.BatchLoader(train, batch_size=64, shuffle=True, seed=0, raw=True)
+    test_loader = fast_data.BatchLoader(test, batch_size=64, raw=True)
+    example = next(iter(test_loader))[0]
+
+    rows = [report("fp32", model, test_loader, example)]
+    quantized = nn.Sequential(normalize, quantize_static(net, _Normalized(train_loader, normalize),
+                                                         args.calibration_batches))
+    rows.append(report("int8 static", quantized, test_loader, example))
+
+    drop = 100 * (rows[0]["accuracy"] - rows[-1]["accuracy"])
+    if args.qat or (args.qat_epochs and drop > args.max_drop):
+        print(f"post-training quantization lost {drop:.2f} points; fine-tuning with QAT for {args.qat_epochs} epochs")
+        qat_model = nn.Sequential(normalize, prepare_qat(net, normalize(example)))
+        optimizer = torch.optim.SGD(qat_model.parameters(), lr=args.qat_lr, momentum=0.9)
+        with _quiet():
+            Trainer(qat_model, nn.CrossEntropyLoss(), optimizer, callbacks=[Throughput()]).fit(
+                train_loader, epochs=args.qat_epochs)
+        quantized = nn.Sequential(normalize, convert_qat(qat_model[1]))
+        rows.append(report("int8 QAT", quantized, test_loader, example))
+
+    save_artifact(quantized, args.output, example)
+    print_table(rows)
+    print(f"saved {args.output} ({os.path.getsize(args.output) / 2**20:.2f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads for the latency runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dynamic = commands.add_parser("dynamic", help="int8 dynamic quantization of the Quickstart MLP")
+    dynamic.add_argument("weights", nargs="?", default="model.pth")
+    dynamic.add_argument("--output", default="model_int8.pt")
+    static = commands.add_parser("static", help="int8 static quantization (and QAT) of the CIFAR10 Net")
+    static.add_argument("weights", nargs="?", default="cifar_net.pth")
+    static.add_argument("--output", default="cifar_net_int8.pt")
+    static.add_argument("--calibration-batches", type=int, default=32, help="training batches of 64 to calibrate on")
+    static.add_argument("--max-drop", type=float, default=1.0, help="accuracy points PTQ may lose before QAT runs")
+    static.add_argument("--qat", action="store_true", help="always fine-tune with QAT")
+    static.add_argument("--qat-epochs", type=int, default=1)
+    static.add_argument("--qat-lr", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"quantized engine: {select_engine()}")
+    if args.command == "dynamic":
+        run_dynamic(args)
+    else:
+        run_static(args)
@@ -0,0 +1,336 @@
+"""Dynamic-batching inference server for the Quickstart FashionMNIST classifier.
+
+Request threads put single images on a queue; one batching thread takes the
+first waiting request, keeps collecting until ``max_batch`` requests or
+``max_latency_ms`` after that first one, and answers the whole batch with one
+forward pass.
+
+    python serve.py serve --weights model.safetensors --max-latency-ms 2    # HTTP on 127.0.0.1:8000
+    python serve.py serve --unix /tmp/fashion.sock
+    python serve.py load --concurrency 64 --requests 20000                  # local load generator
+    python serve.py bench                                                   # batch size 1 vs dynamic batching
+
+``POST /predict`` takes the 784 raw uint8 pixels of one 28x28 image as
+``application/octet-stream`` (or ``{"image": [[...28 floats...] x 28]}`` in
+[0, 1] as JSON) and returns ``{"class": 9, "label": "Ankle boot"}``.
+``GET /stats`` returns throughput, p50/p99 server latency and the mean batch size.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from models import NeuralNetwork
+
+CLASSES = ["T-shirt/top", "Trouser", "Pullover", "Dress", "Coat", "Sandal", "Shirt", "Sneaker", "Bag", "Ankle boot"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def load_model(path=None, make_model=NeuralNetwork):
+    """fp32 ``make_model()`` from a flat ``.safetensors`` file or a ``torch.save``'d state dict.
+
+    An fp32 ``.safetensors`` file is mapped without copying; one stored in
+    fp16/bf16 is converted into a normal fp32 model, since requests arrive as fp32.
+    """
+    if path is None:
+        return make_model().eval()
+    if path.endswith(".safetensors"):
+        import weights
+
+        header, _ = weights.read_header(path)
+        header.pop("__metadata__", None)
+        if all(entry["dtype"] not in ("F16", "BF16", "F64") for entry in header.values()):
+            with torch.device("meta"):
+                model = make_model()
+        else:
+            model = make_model()
+        return weights.load_into(model, path).eval()
+    model = make_model()
+    model.load_state_dict(torch.load(path, map_location="cpu"))
+    return model.eval()
+
+
+class DynamicBatcher:
+    """Coalesce single-sample requests into batches for ``model``.
+
+    uint8 batches are scaled to [0, 1] floats unless ``raw``, for models that
+    start with a ``BatchNormalize`` stage.
+    """
+
+    def __init__(self, model, max_batch=64, max_latency_ms=2.0, raw=False, history=100_000):
+        self.model = model
+        self.raw = raw
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.batches = 0
+        self.served = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, x):
+        """Queue one uint8 or [0, 1] float sample; returns a ``Future`` of its logits.
+
+        Float samples are quantized to uint8 here, so every batch is uint8 and a
+        ``raw`` model's ``BatchNormalize`` stage sees the input it expects.
+        """
+        if x.is_floating_point():
+            x = x.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+        future = Future()
+        self.requests.put((x, future, time.perf_counter()))
+        return future
+
+    def predict(self, x):
+        return self.submit(x).result()
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = batch[0][2] + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                X = torch.stack([x for x, _, _ in batch])
+                if not self.raw:
+                    X = X.float().div_(255)
+                with torch.inference_mode():
+                    logits = self.model(X)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            for row, (_, future, queued) in zip(logits, batch):
+                future.set_result(row)
+            with self._lock:
+                self.latencies.extend(done - queued for _, _, queued in batch)
+                self.batches += 1
+                self.served += len(batch)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            batches, served = self.batches, self.served
+        elapsed = time.perf_counter() - self.started
+        return {
+            "requests": served,
+            "requests_per_sec": served / elapsed if elapsed else 0.0,
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "mean_batch": served / batches if batches else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.latencies.clear()
+            self.batches = self.served = 0
+            self.started = time.perf_counter()
+
+
+def decode_image(body, content_type, shape=(1, 28, 28)):
+    if content_type == "application/json":
+        return torch.tensor(json.loads(body)["image"], dtype=torch.float32).view(shape)
+    size = shape[0] * shape[1] * shape[2]
+    if len(body) != size:
+        raise ValueError(f"expected {size} raw uint8 pixels, got {len(body)} bytes")
+    return torch.frombuffer(bytearray(body), dtype=torch.uint8).view(shape)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so a client reuses its connection
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/predict":
+            return self._reply(404, {"error": "not found"})
+        try:
+            x = decode_image(body, self.headers.get("Content-Type", "application/octet-stream"), self.server.shape)
+        except (ValueError, KeyError, TypeError, RuntimeError) as e:  # malformed JSON, wrong types or shape
+            return self._reply(400, {"error": f"{type(e).__name__}: {e}"})
+        try:
+            index = int(self.server.predict(x).argmax())
+        except Exception as e:
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self._reply(200, {"class": index, "label": self.server.classes[index]})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._reply(200, self.server.stats())
+        self._reply(404, {"error": "not found"})
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # listen backlog; the default of 5 resets connections under a burst
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_server(predict, stats, host="127.0.0.1", port=8000, unix_socket=None, listener=None,
+                shape=(1, 28, 28), classes=CLASSES, handler=Handler):
+    """An HTTP server answering ``/predict`` with ``predict(x)`` and ``/stats`` with ``stats()``.
+
+    ``listener`` is an already listening socket to accept on instead of
+    binding a new one, e.g. one shared by pre-forked workers.
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, handler)
+    elif listener is not None:
+        server = HTTPServer(listener.getsockname(), handler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = listener
+    else:
+        server = HTTPServer((host, port), handler)
+    server.predict = predict
+    server.stats = stats
+    server.shape = shape
+    server.classes = classes
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def connect(host="127.0.0.1", port=8000, unix_socket=None):
+    return UnixHTTPConnection(unix_socket) if unix_socket else http.client.HTTPConnection(host, port)
+
+
+def load_test(requests=10_000, concurrency=32, seed=0, shape=(1, 28, 28), **address):
+    """Send ``requests`` random images from ``concurrency`` keep-alive clients; client-side latency stats."""
+    images = torch.randint(0, 256, (256,) + tuple(shape), dtype=torch.uint8, generator=torch.Generator().manual_seed(seed))
+    payloads = [bytes(image.numpy()) for image in images]
+    latencies, lock = [], threading.Lock()
+    per_client = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def client(n, offset):
+        conn = connect(**address)
+        mine = []
+        for i in range(n):
+            start = time.perf_counter()
+            conn.request("POST", "/predict", payloads[(offset + i) % len(payloads)],
+                         {"Content-Type": "application/octet-stream"})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"server answered {response.status}")
+            mine.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n, i)) for i, n in enumerate(per_client)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": len(latencies) / elapsed,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+def _print_stats(name, client, server=None):
+    line = (f"{name:<24} {client['requests_per_sec']:>10,.0f} req/s  "
+            f"p50 {client['p50_ms']:6.2f} ms  p99 {client['p99_ms']:6.2f} ms")
+    if server is not None:
+        line += f"  mean batch {server['mean_batch']:5.1f}"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "load", "bench"):
+        sub = commands.add_parser(name)
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=8000)
+        sub.add_argument("--unix", metavar="PATH", help="Unix socket instead of TCP")
+        if name != "load":
+            sub.add_argument("--weights", help="model.safetensors (mmap) or model.pth; random weights if omitted")
+            sub.add_argument("--max-batch", type=int, default=64)
+            sub.add_argument("--max-latency-ms", type=float, default=2.0)
+            sub.add_argument("--threads", type=int, help="torch intra-op threads")
+        if name != "serve":
+            sub.add_argument("--requests", type=int, default=10_000)
+            sub.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    address = {"host": args.host, "port": args.port, "unix_socket": args.unix}
+
+    if args.command == "load":
+        _print_stats("load", load_test(args.requests, args.concurrency, **address))
+    else:
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        model = load_model(args.weights)
+        if args.command == "serve":
+            batcher = DynamicBatcher(model, args.max_batch, args.max_latency_ms)
+            server = make_server(batcher.predict, batcher.stats, **address)
+            print(f"serving on {args.unix or f'http://{args.host}:{args.port}'}")
+            server.serve_forever()
+        else:
+            for name, max_batch in (("one request per forward", 1), (f"dynamic (<= {args.max_batch})", args.max_batch)):
+                batcher = DynamicBatcher(model, max_batch, args.max_latency_ms)
+                server = make_server(batcher.predict, batcher.stats, **address)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                load_test(min(args.requests, 500), args.concurrency, **address)  # warm up
+                batcher.reset_stats()
+                _print_stats(name, load_test(args.requests, args.concurrency, **address), batcher.stats())
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,275 @@
+"""Sequential-read shard format for image datasets larger than RAM.
+
+A shard directory holds a handful of large files that are only ever read
+front to back, plus an index:
+
+    index.json          format, sample shape (raw) or classes, shard names and sizes
+    shard-00000.bin     records: int64 label, uint32 payload length, payload bytes
+    ...
+
+``encoded`` shards keep the original JPEG/PNG bytes, ``raw`` shards a fixed-shape
+uint8 array per sample. ``ShardStream`` is an ``IterableDataset`` that shuffles
+the shard order every epoch, splits shards across DataLoader workers (and
+distributed ranks), streams each shard with large buffered reads and mixes
+samples through a bounded shuffle buffer, so nothing needs random access.
+
+    python shards.py pack-folder <image_dir> <out_dir>      labels from sub-folder names
+    python shards.py pack-cifar10 <out_dir> [--test]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import struct
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+RECORD = struct.Struct("<qI")
+READ_BUFFER = 8 << 20
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ShardWriter:
+    """Append samples to numbered shard files, starting a new one every ``shard_bytes``."""
+
+    def __init__(self, out_dir, format="encoded", shape=None, classes=None, shard_bytes=256 << 20):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.shard_bytes = shard_bytes
+        self.index = {"format": format, "shape": shape, "classes": classes, "shards": []}
+        self.file = None
+
+    def _roll(self):
+        self._close_shard()
+        name = "shard-%05d.bin" % len(self.index["shards"])
+        self.file = open(os.path.join(self.out_dir, name), "wb", buffering=READ_BUFFER)
+        self.index["shards"].append({"name": name, "samples": 0, "bytes": 0})
+
+    def _close_shard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write(self, payload, label):
+        shard = self.index["shards"][-1] if self.file is not None else None
+        if shard is None or shard["bytes"] >= self.shard_bytes:
+            self._roll()
+            shard = self.index["shards"][-1]
+        self.file.write(RECORD.pack(int(label), len(payload)))
+        self.file.write(payload)
+        shard["samples"] += 1
+        shard["bytes"] += RECORD.size + len(payload)
+
+    def close(self):
+        self._close_shard()
+        tmp = os.path.join(self.out_dir, "index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, os.path.join(self.out_dir, "index.json"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pack_folder(image_dir, out_dir, shard_bytes=256 << 20, seed=0):
+    """Pack an ImageFolder-style tree (one sub-folder per class) without re-encoding.
+
+    Files are written in a random order so that the shard-level shuffle plus the
+    shuffle buffer give a well mixed stream.
+    """
+    classes = sorted(d for d in os.listdir(image_dir) if os.path.isdir(os.path.join(image_dir, d)))
+    files = []
+    for label, name in enumerate(classes):
+        for root, _, names in os.walk(os.path.join(image_dir, name)):
+            files += [(os.path.join(root, n), label) for n in names if n.lower().endswith(IMAGE_EXTENSIONS)]
+    random.Random(seed).shuffle(files)
+    with ShardWriter(out_dir, "encoded", classes=classes, shard_bytes=shard_bytes) as writer:
+        for path, label in files:
+            with open(path, "rb") as f:
+                writer.write(f.read(), label)
+    return out_dir
+
+
+def pack_arrays(images, labels, out_dir, classes=None, shard_bytes=256 << 20, seed=0):
+    """Pack a decoded uint8 ``[N, ...]`` array (e.g. CIFAR10's ``.data``) as raw samples."""
+    images = np.asarray(images, dtype=np.uint8)
+    order = np.random.default_rng(seed).permutation(len(images))
+    with ShardWriter(out_dir, "raw", shape=list(images.shape[1:]), classes=classes,
+                     shard_bytes=shard_bytes) as writer:
+        for i in order:
+            writer.write(images[i].tobytes(), labels[i])
+    return out_dir
+
+
+def read_shard(path):
+    """Yield ``(label, payload)`` records from one shard, reading it sequentially."""
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        while True:
+            header = f.read(RECORD.size)
+            if not header:
+                return
+            label, length = RECORD.unpack(header)
+            yield label, f.read(length)
+
+
+def decode_raw(shape):
+    def decode(payload):
+        return torch.frombuffer(bytearray(payload), dtype=torch.uint8).view(shape)
+    return decode
+
+
+def decode_encoded(size=None):
+    """JPEG/PNG bytes to a uint8 CHW tensor, optionally resized and centre-cropped to ``size``."""
+    from torchvision.io import ImageReadMode, decode_image
+    from torchvision.transforms.v2 import functional as TF
+
+    def decode(payload):
+        image = decode_image(torch.frombuffer(bytearray(payload), dtype=torch.uint8), ImageReadMode.RGB)
+        if size is not None:
+            image = TF.center_crop(TF.resize(image, size, antialias=True), size)
+        return image
+    return decode
+
+
+class ShardStream(IterableDataset):
+    """Stream ``(image, label)`` samples from a shard directory.
+
+    ``decode`` turns a payload into a tensor; by default raw shards are viewed
+    as their stored shape and encoded shards are decoded (and resized to
+    ``size`` if given). ``transform`` is applied to the decoded tensor.
+
+    ``set_epoch`` picks the shard order and shuffle-buffer seed. ``Trainer`` and
+    ``fastai_dataloaders`` call it at the start of every epoch; other loops
+    must call it themselves, or every epoch repeats the same order.
+
+    Under ``torch.distributed`` each DataLoader worker slot streams as many
+    samples as the same slot on the smallest rank, so every rank produces the
+    same number of samples and batches per epoch (the surplus is dropped, and
+    a different part of it every epoch).
+    """
+
+    def __init__(self, shard_dir, decode=None, transform=None, size=None, shuffle=True,
+                 buffer_size=2048, seed=0):
+        with open(os.path.join(shard_dir, "index.json")) as f:
+            self.index = json.load(f)
+        self.shard_dir = shard_dir
+        self.classes = self.index["classes"]
+        if decode is None:
+            if self.index["format"] == "raw":
+                decode = decode_raw(self.index["shape"])
+            else:
+                decode = decode_encoded(size)
+        self.decode = decode
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return sum(s["samples"] for s in self.index["shards"])
+
+    def _my_shards(self):
+        """This worker's shard names and how many samples it may stream from them."""
+        shards = [(s["name"], s["samples"]) for s in self.index["shards"]]
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        rank, world = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        worker = get_worker_info()
+        worker_id, workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+
+        # split by distributed rank first, then by DataLoader worker
+        def split(r):
+            return shards[r::world][worker_id::workers]
+
+        quota = min(sum(n for _, n in split(r)) for r in range(world))
+        return [name for name, _ in split(rank)], quota
+
+    def _samples(self, shards):
+        for name in shards:
+            for label, payload in read_shard(os.path.join(self.shard_dir, name)):
+                image = self.decode(payload)
+                if self.transform is not None:
+                    image = self.transform(image)
+                yield image, label
+
+    def __iter__(self):
+        shards, quota = self._my_shards()
+        samples = itertools.islice(self._samples(shards), quota)
+        if not self.shuffle:
+            yield from samples
+            return
+        worker = get_worker_info()
+        rng = random.Random((self.seed + self.epoch) * 1000 + (worker.id if worker else 0))
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+def fastai_dataloaders(train_dir, valid_dir, bs=64, size=224, **kwargs):
+    """fastai ``DataLoaders`` over two shard directories, for ``vision_learner``."""
+    from fastai.vision.all import (DataLoaders, IntToFloatTensor, Normalize, TensorCategory, TensorImage,
+                                   TfmdDL, imagenet_stats)
+
+    def to_fastai(sample):
+        image, label = sample
+        return TensorImage(image), TensorCategory(label)
+
+    class EpochDL(TfmdDL):
+        # runs in the main process before workers start, so they see the new epoch
+        def before_iter(self):
+            super().before_iter()
+            self.epochs_started = getattr(self, "epochs_started", -1) + 1
+            self.dataset.set_epoch(self.epochs_started)
+
+    train, valid = ShardStream(train_dir, size=size), ShardStream(valid_dir, size=size, shuffle=False)
+    after_batch = [IntToFloatTensor(), Normalize.from_stats(*imagenet_stats)]
+    dls = DataLoaders(EpochDL(train, bs=bs, after_item=to_fastai, after_batch=after_batch, **kwargs),
+                      TfmdDL(valid, bs=bs, after_item=to_fastai, after_batch=after_batch, **kwargs))
+    dls.vocab = train.classes
+    dls.c = len(train.classes)
+    return dls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    folder = sub.add_parser("pack-folder")
+    folder.add_argument("image_dir")
+    folder.add_argument("out_dir")
+    cifar = sub.add_parser("pack-cifar10")
+    cifar.add_argument("out_dir")
+    cifar.add_argument("--root", default="data")
+    cifar.add_argument("--test", action="store_true")
+    for p in (folder, cifar):
+        p.add_argument("--shard-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.command == "pack-folder":
+        pack_folder(args.image_dir, args.out_dir, shard_bytes=args.shard_mb << 20)
+    else:
+        from torchvision import datasets
+        ds = datasets.CIFAR10(args.root, train=not args.test, download=True)
+        # stored CHW so decoded samples match ToTensor's layout
+        pack_arrays(ds.data.transpose(0, 3, 1, 2), ds.targets, args.out_dir, classes=ds.classes,
+                    shard_bytes=args.shard_mb << 20)
+    stream = ShardStream(args.out_dir)
+    print(f"{len(stream)} samples in {len(stream.index['shards'])} shards under {args.out_dir}")
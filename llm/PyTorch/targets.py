@@ -0,0 +1,38 @@
+"""Batch-level label encoding.
+
+``OneHotCollate`` turns the integer labels of a whole batch into one-hot (or
+label-smoothed) rows with a single scatter into one buffer, instead of
+allocating two tensors per sample in a ``target_transform``.
+
+Often the cheapest encoding is none at all: keep the integer labels and let
+``nn.CrossEntropyLoss(label_smoothing=...)`` apply the encoding inside the loss.
+"""
+import torch
+from torch.utils.data import default_collate
+
+
+def one_hot(labels, num_classes, smoothing=0.0, dtype=torch.float, out=None):
+    """Encode a 1-d integer label tensor as ``[N, num_classes]`` targets.
+
+    With ``smoothing`` the off-class entries get ``smoothing / num_classes`` and the
+    true class the rest, matching ``CrossEntropyLoss(label_smoothing=smoothing)``.
+    """
+    labels = torch.as_tensor(labels, dtype=torch.int64)
+    if out is None:
+        out = torch.empty(len(labels), num_classes, dtype=dtype, device=labels.device)
+    off = smoothing / num_classes
+    out.fill_(off)
+    return out.scatter_(1, labels.unsqueeze(1), 1.0 - smoothing + off)
+
+
+class OneHotCollate:
+    """``collate_fn`` that encodes the labels after the batch has been collated."""
+
+    def __init__(self, num_classes, smoothing=0.0, collate_fn=default_collate):
+        self.num_classes = num_classes
+        self.smoothing = smoothing
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        X, y = self.collate_fn(batch)
+        return X, one_hot(y, self.num_classes, self.smoothing)
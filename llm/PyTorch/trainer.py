@@ -0,0 +1,294 @@
+"""Shared training engine for the tutorial scripts.
+
+``Trainer`` runs the zero_grad/forward/backward/step loop once for everyone
+and times every step: ``data_time`` is spent waiting for the next batch and
+moving it to the device, ``compute_time`` in the step itself. Anything
+script-specific (printing, TensorBoard, checkpoints, ...) is a ``Callback``.
+
+Losses are accumulated on the device; nothing calls ``.item()`` unless a
+callback asks for a value.
+"""
+import contextlib
+import time
+
+import torch
+from torch import nn
+
+from metrics import ClassificationMetrics
+
+
+AUTOCAST_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def _dataset_len(loader):
+    try:
+        return len(loader.dataset)
+    except (AttributeError, TypeError):
+        return None
+
+
+def _sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+class StepStats:
+    """Running totals for one epoch (or one evaluation pass)."""
+
+    def __init__(self):
+        self.steps = 0
+        self.samples = 0
+        self.data_time = 0.0
+        self.compute_time = 0.0
+
+    @property
+    def total_time(self):
+        return self.data_time + self.compute_time
+
+    @property
+    def samples_per_sec(self):
+        return self.samples / self.total_time if self.total_time else 0.0
+
+    def __str__(self):
+        return (f"{self.steps} steps, {self.samples_per_sec:,.0f} samples/sec, "
+                f"data {self.data_time:.2f}s, compute {self.compute_time:.2f}s "
+                f"({100 * self.data_time / max(self.total_time, 1e-9):.0f}% waiting on data)")
+
+
+class Callback:
+    """Hooks called by ``Trainer``; override the ones you need."""
+
+    def on_fit_start(self, trainer): pass
+    def on_epoch_start(self, trainer): pass
+    def on_step_end(self, trainer): pass
+    def on_epoch_end(self, trainer): pass
+    def on_evaluate_end(self, trainer, results): pass
+    def on_fit_end(self, trainer): pass
+
+
+class Trainer:
+    """Runs training and evaluation loops and calls ``callbacks`` along the way.
+
+    During a step callbacks can read ``epoch``, ``batch_index``, ``global_step``,
+    ``batch`` (the ``(X, y)`` on the device), ``batch_size``, ``epoch_samples``
+    (None if unknown), ``loss`` (a detached device tensor) and ``stats``.
+
+    ``sync_timing`` synchronizes CUDA around each step so ``compute_time`` is
+    the real kernel time rather than launch time; it costs the async overlap.
+
+    ``precision`` is ``"fp32"``, ``"bf16"`` or ``"fp16"``. The reduced ones run the
+    forward pass (training and evaluation) under ``torch.autocast``, so weights,
+    gradients and optimizer state stay fp32. Only fp16 needs loss scaling; bf16
+    has fp32's exponent range and runs without a ``GradScaler``.
+
+    ``memory_format`` (e.g. ``torch.channels_last``) is applied to 4-D inputs as
+    they are moved to the device; convert the model to the same format.
+
+    With ``accumulation_steps`` > 1 gradients of that many micro-batches are
+    averaged before each optimizer step; a short group at the end of an epoch is
+    averaged over its own length and stepped as well. ``scheduler`` is stepped
+    after every optimizer step, not every micro-batch.
+    """
+
+    def __init__(self, model, loss_fn, optimizer=None, device="cpu", callbacks=(), sync_timing=False,
+                 precision="fp32", memory_format=None, accumulation_steps=1, scheduler=None):
+        self.model = model
+        self.loss_fn = loss_fn
+        self.optimizer = optimizer
+        self.device = torch.device(device)
+        self.callbacks = list(callbacks)
+        self.sync_timing = sync_timing
+        self.precision = precision
+        self.autocast_dtype = AUTOCAST_DTYPES[precision]
+        self.scaler = torch.amp.GradScaler(self.device.type) if precision == "fp16" else None
+        self.memory_format = memory_format
+        self.accumulation_steps = accumulation_steps
+        self.scheduler = scheduler
+        self.pending_micro_batches = 0
+        self.start_batch = 0
+        self.epoch = 0
+        self.global_step = 0
+        self.batch_index = 0
+        self.batch = None
+        self.batch_size = 0
+        self.epoch_samples = None
+        self.loss = None
+        self.stats = StepStats()
+
+    def _call(self, hook, *args):
+        for callback in self.callbacks:
+            getattr(callback, hook)(self, *args)
+
+    def _set_mode(self, training):
+        if isinstance(self.model, nn.Module):
+            self.model.train(training)
+
+    def to_device(self, X, y):
+        if self.memory_format is not None and X.dim() == 4:
+            X = X.to(self.device, memory_format=self.memory_format, non_blocking=True)
+        else:
+            X = X.to(self.device, non_blocking=True)
+        return X, y.to(self.device, non_blocking=True)
+
+    def autocast(self):
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=self.autocast_dtype)
+
+    def forward(self, X, y):
+        with self.autocast():
+            return self.loss_fn(self.model(X), y)
+
+    def train_step(self, X, y):
+        """One optimization step; returns the detached loss. Override for custom updates."""
+        loss = self.forward(X, y)
+        scaled = loss / self.accumulation_steps if self.accumulation_steps > 1 else loss
+        if self.scaler is not None:
+            scaled = self.scaler.scale(scaled)
+        scaled.backward()
+        self.pending_micro_batches += 1
+        if self.pending_micro_batches == self.accumulation_steps:
+            self.optimizer_step()
+        return loss.detach()
+
+    def optimizer_step(self):
+        if self.scaler is not None:
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        else:
+            self.optimizer.step()
+        self.optimizer.zero_grad()
+        if self.scheduler is not None:
+            self.scheduler.step()
+        self.pending_micro_batches = 0
+
+    @torch.no_grad()
+    def _scale_gradients(self, factor):
+        for group in self.optimizer.param_groups:
+            for p in group["params"]:
+                if p.grad is not None:
+                    p.grad.mul_(factor)
+
+    def train_epoch(self, loader):
+        """One pass over ``loader``; a resumed run starts at ``start_batch`` (set by ``checkpoint.resume``)."""
+        self._set_mode(True)
+        self.stats = StepStats()
+        self.epoch_samples = _dataset_len(loader)
+        # the sampler orders map-style data; an IterableDataset (shards.ShardStream) orders itself
+        for source in (getattr(loader, "sampler", None), getattr(loader, "dataset", None)):
+            if hasattr(source, "set_epoch"):
+                source.set_epoch(self.epoch)
+        self._call("on_epoch_start")
+        batches = iter(loader)
+        self.batch_index, self.start_batch = self.start_batch, 0
+        while True:
+            start = time.perf_counter()
+            try:
+                X, y = next(batches)
+            except StopIteration:
+                break
+            X, y = self.to_device(X, y)
+            ready = time.perf_counter()
+            self.batch = (X, y)
+            self.batch_size = len(X)
+            self.loss = self.train_step(X, y)
+            if self.sync_timing:
+                _sync(self.device)
+            done = time.perf_counter()
+
+            self.stats.steps += 1
+            self.stats.samples += self.batch_size
+            self.stats.data_time += ready - start
+            self.stats.compute_time += done - ready
+            self._call("on_step_end")
+            self.batch_index += 1
+            self.global_step += 1
+        if self.pending_micro_batches:
+            # the short last group was divided by accumulation_steps like a full one
+            self._scale_gradients(self.accumulation_steps / self.pending_micro_batches)
+            self.optimizer_step()
+        self._call("on_epoch_end")
+        self.epoch += 1
+        return self.stats
+
+    @torch.no_grad()
+    def evaluate(self, loader):
+        """Loss, accuracy and per-class metrics over ``loader``.
+
+        Everything is accumulated in a ``ClassificationMetrics`` on the device and
+        read back once at the end; ``results["metrics"]`` has the full report.
+        """
+        self._set_mode(False)
+        metrics = None
+        for X, y in loader:
+            X, y = self.to_device(X, y)
+            with self.autocast():
+                pred = self.model(X).float()
+            if metrics is None:
+                metrics = ClassificationMetrics(pred.shape[1], self.device)
+            metrics.update(pred, y, self.loss_fn(pred, y))
+        results = metrics.compute() if metrics is not None else {"loss": 0.0, "accuracy": 0.0}
+        results["metrics"] = metrics
+        self._call("on_evaluate_end", results)
+        return results
+
+    def fit(self, train_loader, epochs=1, val_loader=None):
+        self._call("on_fit_start")
+        for _ in range(epochs):
+            self.train_epoch(train_loader)
+            if val_loader is not None:
+                self.evaluate(val_loader)
+        self._call("on_fit_end")
+        return self
+
+
+class PrintLoss(Callback):
+    """Print the current step's loss every ``every`` steps, Quickstart style."""
+
+    def __init__(self, every=100):
+        self.every = every
+
+    def on_step_end(self, trainer):
+        if trainer.batch_index % self.every == 0:
+            loss, current, size = trainer.loss.item(), trainer.stats.samples, trainer.epoch_samples
+            if size is None:
+                print(f"loss: {loss:>7f}  [{current:>5d}]")
+            else:
+                print(f"loss: {loss:>7f}  [{current:>5d}/{size:>5d}]")
+
+
+class RunningLoss(Callback):
+    """Print the mean loss of the last ``every`` steps, CIFAR10 tutorial style."""
+
+    def __init__(self, every=2000):
+        self.every = every
+        self.running = None
+
+    def on_epoch_start(self, trainer):
+        self.running = None
+
+    def on_step_end(self, trainer):
+        self.running = trainer.loss if self.running is None else self.running + trainer.loss
+        if trainer.batch_index % self.every == self.every - 1:
+            print('[%d, %5d] loss: %.3f' %
+                  (trainer.epoch + 1, trainer.batch_index + 1, self.running.item() / self.every))
+            self.running = None
+
+
+class Throughput(Callback):
+    """Print the step timing breakdown at the end of every epoch."""
+
+    def on_epoch_end(self, trainer):
+        print(f"epoch {trainer.epoch + 1}: {trainer.stats}")
+
+
+class PrintEpochLoss(Callback):
+    """Print the last step's loss every ``every`` epochs, for full-batch loops."""
+
+    def __init__(self, every=500):
+        self.every = every
+
+    def on_epoch_end(self, trainer):
+        epoch = trainer.epoch + 1
+        if epoch % self.every == 0:
+            print(f'Epoch {epoch}, Loss {trainer.loss.item()}')
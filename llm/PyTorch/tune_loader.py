@@ -0,0 +1,182 @@
+"""Measure DataLoader settings on this machine and save the fastest as a profile.
+
+    python tune_loader.py cifar10 --batch-sizes 4 32 128 --workers 0 1 2 4
+
+Every trial times the loader on its own, the model step on its own, and the
+two together. The loader stops being the bottleneck at the first worker count
+whose loader-only rate keeps up with the model step. The fastest end-to-end
+setting per task is written to ``loader_profile.json`` and picked up by the
+scripts through ``load_profile()``.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loader_profile.json")
+LOADER_KEYS = ("batch_size", "num_workers", "pin_memory", "persistent_workers")
+
+
+def load_profile(task, path=PROFILE_PATH, **defaults):
+    """DataLoader keyword arguments for ``task``: the tuned ones if present, else ``defaults``."""
+    settings = dict(defaults)
+    if os.path.exists(path):
+        with open(path) as f:
+            tuned = json.load(f).get(task, {})
+        settings.update({k: tuned[k] for k in LOADER_KEYS if k in tuned})
+    if not settings.get("num_workers"):
+        settings.pop("persistent_workers", None)
+    return settings
+
+
+def save_profile(task, settings, path=PROFILE_PATH):
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[task] = settings
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+
+def build_task(task, root):
+    """Training split and model for each script, fed the way the script feeds it."""
+    from torchvision import datasets, transforms
+
+    from batch_transforms import RawImages, normalized
+    from models import NeuralNetwork, Net
+
+    if task == "quickstart":
+        dataset = datasets.FashionMNIST(root, train=True, download=True, transform=transforms.ToTensor())
+        return dataset, NeuralNetwork()
+    if task == "tensorboard":
+        transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize((0.5,), (0.5,))])
+        dataset = datasets.FashionMNIST(root, train=True, download=True, transform=transform)
+        return dataset, Net(1, 28)
+    if task == "cifar10":
+        dataset = RawImages(datasets.CIFAR10(root, train=True, download=True))
+        return dataset, normalized(Net(), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+    raise ValueError(f"unknown task {task!r}")
+
+
+def _batches(loader, steps):
+    it = iter(loader)
+    for _ in range(steps):
+        try:
+            yield next(it)
+        except StopIteration:
+            it = iter(loader)
+            yield next(it)
+
+
+def _train_step(model, optimizer, loss_fn, X, y, device):
+    X, y = X.to(device, non_blocking=True), y.to(device, non_blocking=True)
+    loss = loss_fn(model(X), y)
+    loss.backward()
+    optimizer.step()
+    optimizer.zero_grad()
+
+
+def _sync(device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def time_loader(loader, steps, epochs=2):
+    """Samples/sec of iterating ``loader``, including iterator (worker) start-up per epoch."""
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for X, _ in _batches(loader, steps):
+            samples += len(X)
+    return samples / (time.perf_counter() - start)
+
+
+def time_compute(model, batch, steps, device):
+    """Samples/sec of the training step alone, on one batch reused every step."""
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+    loss_fn = nn.CrossEntropyLoss()
+    X, y = batch[0].to(device), batch[1].to(device)
+    _train_step(model, optimizer, loss_fn, X, y, device)
+    _sync(device)
+    start = time.perf_counter()
+    for _ in range(steps):
+        _train_step(model, optimizer, loss_fn, X, y, device)
+    _sync(device)
+    return steps * len(X) / (time.perf_counter() - start)
+
+
+def time_end_to_end(loader, model, steps, device, epochs=2):
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+    loss_fn = nn.CrossEntropyLoss()
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for X, y in _batches(loader, steps):
+            _train_step(model, optimizer, loss_fn, X, y, device)
+            samples += len(X)
+    _sync(device)
+    return samples / (time.perf_counter() - start)
+
+
+def tune(task, dataset, model, device, batch_sizes, workers, steps):
+    pin_options = (False, True) if device == "cuda" else (False,)
+    model = model.to(device)
+    results = []
+    for batch_size in batch_sizes:
+        probe = next(iter(DataLoader(dataset, batch_size=batch_size)))
+        compute = time_compute(model, probe, steps, device)
+        print(f"{task} batch_size={batch_size}: model step alone {compute:,.0f} samples/sec")
+        for num_workers, pin_memory, persistent in itertools.product(workers, pin_options, (False, True)):
+            if persistent and num_workers == 0:
+                continue
+            settings = dict(batch_size=batch_size, num_workers=num_workers, pin_memory=pin_memory,
+                            persistent_workers=persistent)
+            loader = DataLoader(dataset, shuffle=True, **settings)
+            loading = time_loader(loader, steps)
+            total = time_end_to_end(loader, model, steps, device)
+            results.append(dict(settings, loader_samples_per_sec=loading, compute_samples_per_sec=compute,
+                                samples_per_sec=total, loader_bound=loading < compute))
+            print(f"  workers={num_workers} pin={pin_memory!s:5} persistent={persistent!s:5} "
+                  f"loader {loading:>10,.0f}  end-to-end {total:>10,.0f} samples/sec"
+                  f"{'  <- loader bound' if loading < compute else ''}")
+        unbound = [r for r in results if r["batch_size"] == batch_size and not r["loader_bound"]]
+        if unbound:
+            print(f"  loader keeps up from num_workers={min(r['num_workers'] for r in unbound)}")
+        else:
+            print("  loader is the bottleneck at every worker count tried")
+    # prefer fewer workers when two settings are within 3% of each other
+    best = max(results, key=lambda r: r["samples_per_sec"])
+    close = [r for r in results if r["samples_per_sec"] >= 0.97 * best["samples_per_sec"]]
+    return dict(min(close, key=lambda r: (r["num_workers"], -r["samples_per_sec"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("task", choices=["quickstart", "tensorboard", "cifar10"])
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 16, 64, 256])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--steps", type=int, default=50, help="batches per timed pass")
+    parser.add_argument("--profile", default=PROFILE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="report only, do not write the profile")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dataset, model = build_task(args.task, args.root)
+    best = tune(args.task, dataset, model, device, args.batch_sizes, args.workers, args.steps)
+    best["host"] = platform.node()
+    best["device"] = device
+    print(f"best: batch_size={best['batch_size']} num_workers={best['num_workers']} "
+          f"pin_memory={best['pin_memory']} persistent_workers={best['persistent_workers']} "
+          f"({best['samples_per_sec']:,.0f} samples/sec)")
+    if not args.dry_run:
+        save_profile(args.task, best, args.profile)
+        print(f"saved to {args.profile}")
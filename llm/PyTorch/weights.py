@@ -0,0 +1,155 @@
+"""A flat, memory-mappable weight format (the safetensors layout) and a zero-copy loader.
+
+    <8-byte little-endian header size> <JSON header> <tensor bytes ...>
+
+The header maps each name to its dtype, shape and byte range in the data
+section. ``load`` maps the file and returns tensors that are views of the
+mapping, so nothing is read until a tensor is touched, and every process that
+loads the same file shares one page-cache copy. ``load_into`` assigns those
+views as the module's parameters instead of copying into them; build the
+module on the ``meta`` device first and startup costs no weight copies at all.
+
+The files are readable by the ``safetensors`` package, but it is not needed.
+
+    python weights.py convert model.pth model.safetensors --dtype bf16
+    python weights.py bench model.safetensors
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+import torch
+
+DTYPES = {
+    torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16", torch.float64: "F64",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8", torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+STORAGE_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+_ALIGN = 8
+
+
+def save(state_dict, path, dtype=None, metadata=None):
+    """Write ``state_dict`` to ``path``; floating tensors are stored as ``dtype`` if given."""
+    header, tensors, offset = {}, [], 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        tensor = tensor.contiguous()
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape),
+                        "data_offsets": [offset, offset + size]}
+        tensors.append(tensor)
+        offset += size
+    if metadata:
+        header["__metadata__"] = {k: str(v) for k, v in metadata.items()}
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    encoded += b" " * (-(len(encoded) + 8) % _ALIGN)  # keeps every tensor aligned to its element size
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for tensor in tensors:
+            if tensor.numel():
+                f.write(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+    return header, 8 + size
+
+
+def load(path):
+    """``{name: tensor}`` viewing a private (copy-on-write) mapping of ``path``.
+
+    Writing to a returned tensor copies just the touched pages for this
+    process; the file is never modified.
+    """
+    header, start = read_header(path)
+    header.pop("__metadata__", None)
+    names = {v: k for k, v in DTYPES.items()}
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state = {}
+    for name, entry in header.items():
+        begin, end = entry["data_offsets"]
+        dtype = names[entry["dtype"]]
+        if begin == end:
+            state[name] = torch.empty(entry["shape"], dtype=dtype)
+            continue
+        # each tensor keeps a reference to the mapping, which stays open as long as any of them is alive
+        flat = torch.frombuffer(mapped, dtype=dtype, offset=start + begin,
+                                count=(end - begin) // torch.empty((), dtype=dtype).element_size())
+        state[name] = flat.view(entry["shape"])
+    return state
+
+
+def load_into(module, path, strict=True):
+    """Load ``path`` into ``module`` without copying where the stored dtypes match.
+
+    Parameters whose dtype matches the file become views of the mapping
+    (``assign=True``); with a different storage dtype (e.g. a bf16 file into an
+    fp32 model) each tensor is converted into a new copy instead. A module
+    built on the ``meta`` device gets the file's dtypes as they are.
+    """
+    state = load(path)
+    current = module.state_dict()
+    on_meta = any(t.is_meta for t in current.values())
+    if not on_meta:
+        state = {k: v.to(current[k].dtype) if k in current else v for k, v in state.items()}
+    module.load_state_dict(state, strict=strict, assign=True)
+    return module
+
+
+def _bench(path, make_model, repeat=5):
+    def pickled():
+        model = make_model()
+        model.load_state_dict(torch.load(pth, map_location="cpu"))
+        return model
+
+    def mapped():
+        with torch.device("meta"):
+            model = make_model()
+        return load_into(model, path)
+
+    pth = path + ".bench.pth"
+    torch.save(load(path), pth)
+    try:
+        for name, fn in (("torch.load + load_state_dict", pickled), ("mmap + assign (meta init)", mapped)):
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            print(f"{name:<30} {1000 * (time.perf_counter() - start) / repeat:8.2f} ms")
+    finally:
+        os.remove(pth)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="rewrite a torch.save'd state dict in the flat format")
+    convert.add_argument("source")
+    convert.add_argument("target")
+    convert.add_argument("--dtype", choices=list(STORAGE_DTYPES), help="storage dtype of floating tensors")
+    bench = commands.add_parser("bench", help="time loading a Quickstart model both ways")
+    bench.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        state = torch.load(args.source, map_location="cpu")
+        save(state, args.target, STORAGE_DTYPES.get(args.dtype))
+        print(f"{args.source} ({os.path.getsize(args.source):,} bytes) -> "
+              f"{args.target} ({os.path.getsize(args.target):,} bytes)")
+    else:
+        from models import NeuralNetwork
+
+        _bench(args.path, NeuralNetwork)
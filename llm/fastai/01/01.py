@@ -2,13 +2,14 @@
 #caption Results from the first training
 # CLICK ME
 from fastai.vision.all import *
-path = untar_data(URLs.PETS)/'images'
+from pets_cache import cached_dls, is_prepared, prepare
 
-def is_cat(x): return x[0].isupper()
-dls = ImageDataLoaders.from_name_func(
-    path, get_image_files(path), valid_pct=0.2, seed=42,
-    label_func=is_cat, item_tfms=Resize(224))
+# Resized images are packed into pets_cache/ on the first run (or by `python pets_cache.py`);
+# later runs skip the directory walk and the per-epoch JPEG decode + Resize(224).
+if not is_prepared('pets_cache'):
+    path = untar_data(URLs.PETS)/'images'
+    prepare(path, 'pets_cache')
+dls = cached_dls('pets_cache', valid_pct=0.2, seed=42)
 
 learn = vision_learner(dls, resnet34, metrics=error_rate)
 learn.fine_tune(1)
-